@@ -0,0 +1,73 @@
+import io
+from typing import BinaryIO, Optional
+from engine import PdfInput, ResizeJob, resize_stream
+from streaming import Optimize
+from transforms import Engine, FitMode, Format, format_dimensions
+
+# Label of the documents resized in memory, in place of their paths
+MEMORY_LABEL = '<memory>'
+
+def run_in_memory(job: ResizeJob, source: PdfInput, output: Optional[BinaryIO]=None) -> Optional[bytes]:
+    """
+    Run `job` on a document in memory (see engine.resize_stream).
+
+    Returns:
+        bytes, optional: The resized document, None when it was written to `output`.
+    """
+    if output is not None:
+        resize_stream(job, source, output)
+        return None
+    buffer = io.BytesIO()
+    resize_stream(job, source, buffer)
+    return buffer.getvalue()
+
+def resize_pdf(
+        source: PdfInput,
+        desired_format: Format="A4",
+        output: Optional[BinaryIO]=None,
+        tolerance: float=1.0,
+        engine: Engine="scale",
+        fit: FitMode="stretch",
+        window: int=0,
+        optimize: Optimize="none",
+        max_dpi: int=0,
+        jpeg_quality: int=80
+    ) -> Optional[bytes]:
+    """
+    Resize a PDF to a paper format entirely in memory, without any file or folder.
+
+    Meant for services that receive the document in a request. The options
+    are the ones of ResizePDF; with `window` the pages are written to `output`
+    as they are resized, so the output is never whole in memory.
+
+    Args:
+        source (PdfInput): The document as bytes, bytearray or memoryview, or a readable
+            binary file object (read whole first when it cannot seek).
+        desired_format (Format): The target paper format.
+        output (BinaryIO, optional): Receives the resized document, only its `write`
+            method is used. When None the document is returned.
+
+    Returns:
+        bytes, optional: The resized document, None when it was written to `output`.
+            A document already in the format comes back as it is, unless
+            `max_dpi` or `optimize` asks to rewrite it.
+
+    Raises:
+        ValueError: Unknown format, or "fit" without the "xobject" engine.
+        pypdf.errors.PdfReadError: The document cannot be parsed.
+    """
+    if engine == "scale" and fit != "stretch":
+        raise ValueError('The "fit" mode needs the "xobject" engine.')
+    job = ResizeJob(
+        source_path=MEMORY_LABEL,
+        output_path=MEMORY_LABEL,
+        dimensions=format_dimensions(desired_format),
+        tolerance=tolerance,
+        engine=engine,
+        fit=fit,
+        window=window,
+        optimize=optimize,
+        max_dpi=max_dpi,
+        jpeg_quality=jpeg_quality
+    )
+    return run_in_memory(job, source, output)
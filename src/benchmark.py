@@ -0,0 +1,356 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import pypdf
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+from engine import ResizeJob, matches_dimensions, resize_document, run_batch
+from images import Image
+from streaming import OPTIMIZE_LEVELS
+from synthetic import generate_corpus
+from utils.bcolors import bcolors
+
+try:
+    import resource
+except ImportError:
+    # Windows: peak RSS is not reported
+    resource = None
+
+ENGINES = [
+    {"engine": "scale", "fit": "stretch"},
+    {"engine": "xobject", "fit": "stretch"},
+    {"engine": "xobject", "fit": "fit"}
+]
+
+# The xobject engine keeps the transform cheap, so reading the source weighs more in the timing
+INPUT_MODES = [
+    {"engine": "xobject", "input_mode": "buffered"},
+    {"engine": "xobject", "input_mode": "mmap"},
+    {"engine": "xobject", "input_mode": "memory"},
+    {"engine": "xobject", "input_mode": "buffered", "window": 32},
+    {"engine": "xobject", "input_mode": "mmap", "window": 32},
+    {"engine": "xobject", "input_mode": "memory", "window": 32}
+]
+
+# Options crossed by the round-trip check, see check_outputs
+CHECK_OPTIONS = {
+    "engine": ["scale", "xobject"],
+    "window": [0, 4],
+    "optimize": OPTIMIZE_LEVELS,
+    "max_dpi": [0, 72]
+}
+
+def list_corpus(corpus_path: str) -> List[str]:
+    return sorted(
+        os.path.join(corpus_path, name)
+        for name in os.listdir(corpus_path)
+        if name.lower().endswith('.pdf')
+    )
+
+# How the documents are spread over processes, see measure_mode
+MODES = ["serial", "pool", "page-parallel"]
+
+def benchmark_variants(
+        documents: List[str],
+        dimensions: tuple[float, float],
+        variants: List[dict],
+        repeat: int=3
+    ) -> List[dict]:
+    """
+    Resize every PDF of `documents` once per variant, `repeat` times, and time it.
+
+    Args:
+        variants (List[dict]): ResizeJob options of each variant, e.g. {"engine": "xobject"}.
+
+    Returns:
+        List[dict]: One row per variant with pages, median seconds, pages and MB per second.
+    """
+    rows = []
+    total_bytes = sum(os.path.getsize(document) for document in documents)
+    with tempfile.TemporaryDirectory() as output_path:
+        for options in variants:
+            runs = []
+            pages = 0
+            for _ in range(repeat):
+                start = time.perf_counter()
+                pages = 0
+                for document in documents:
+                    result = resize_document(ResizeJob(
+                        source_path=document,
+                        output_path=os.path.join(output_path, os.path.basename(document)),
+                        dimensions=dimensions,
+                        tolerance=0.0,
+                        **options
+                    ))
+                    pages += result.pages
+                runs.append(time.perf_counter() - start)
+            seconds = statistics.median(runs)
+            rows.append({
+                "variant": ", ".join(f"{key}={value}" for key, value in options.items()),
+                "pages": pages,
+                "seconds": seconds,
+                "pages_per_second": pages / seconds,
+                "mb_per_second": total_bytes / seconds / 1024 / 1024
+            })
+    return rows
+
+def check_document(path: str, pages: int, dimensions: tuple[float, float]) -> Optional[str]:
+    """
+    Read an output back with a strict PdfReader, resolving every object it references.
+
+    Returns:
+        str, optional: What is wrong with the output, None when it is valid.
+    """
+    try:
+        reader = pypdf.PdfReader(path, strict=True)
+        if len(reader.pages) != pages:
+            return f'{len(reader.pages)} pages instead of {pages}'
+        for number, page in enumerate(reader.pages, start=1):
+            if not matches_dimensions((float(page.mediabox.width), float(page.mediabox.height)), dimensions, 1.0):
+                return f'page {number} is {page.mediabox.width} x {page.mediabox.height}'
+        pending, seen = [reader.trailer], set()
+        while pending:
+            obj = pending.pop()
+            if isinstance(obj, IndirectObject):
+                if obj.idnum in seen:
+                    continue
+                seen.add(obj.idnum)
+                obj = obj.get_object()
+            if isinstance(obj, StreamObject):
+                obj.get_data()
+            if isinstance(obj, DictionaryObject):
+                pending.extend(value for key, value in obj.items() if key != "/Parent")
+            elif isinstance(obj, ArrayObject):
+                pending.extend(obj)
+    except Exception as error:
+        return f'{type(error).__name__}: {error}'
+    return None
+
+def check_outputs(documents: List[str], dimensions: tuple[float, float]) -> List[str]:
+    """
+    Resize every document with every combination of CHECK_OPTIONS and check the outputs.
+
+    Each output must open with a strict PdfReader, keep the page count of its
+    source, have pages of `dimensions` and decode every stream it holds
+    (see `check_document`). Without Pillow images are not downsampled.
+
+    Returns:
+        List[str]: One line per job or output that failed, empty when all are valid.
+    """
+    options = dict(CHECK_OPTIONS, max_dpi=CHECK_OPTIONS["max_dpi"] if Image is not None else [0])
+    failures = []
+    with tempfile.TemporaryDirectory() as output_path:
+        for values in itertools.product(*options.values()):
+            variant = dict(zip(options, values))
+            label = ", ".join(f"{key}={value}" for key, value in variant.items())
+            for document in documents:
+                output = os.path.join(output_path, os.path.basename(document))
+                result = resize_document(ResizeJob(source_path=document, output_path=output, dimensions=dimensions, **variant))
+                problem = result.error if result.status != "done" else check_document(output, result.pages, dimensions)
+                if problem:
+                    failures.append(f'{os.path.basename(document)} ({label}): {problem}')
+            print(f'{bcolors.OKBLUE}Checked {label}{bcolors.ENDC}')
+    return failures
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process and of its largest finished child, in MB."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+def measure_context() -> multiprocessing.context.BaseContext:
+    """
+    Context of the processes running a measure.
+
+    Linux carries the peak RSS over fork and exec, so they come from a fork
+    server started before the benchmarks grow this process (see `main`).
+    """
+    return multiprocessing.get_context("forkserver" if resource is not None else "spawn")
+
+def fork_workers() -> None:
+    """
+    Initializer of the measure processes: their pool workers are forked by them
+    instead of the fork server, so RUSAGE_CHILDREN covers the workers.
+    """
+    if resource is not None:
+        multiprocessing.set_start_method("fork", force=True)
+
+def measure_mode(
+        mode: str,
+        documents: List[str],
+        dimensions: tuple[float, float],
+        options: dict,
+        workers: Optional[int]=None,
+        split_threshold: int=100
+    ) -> dict:
+    """
+    Resize `documents` once in the given mode and measure it.
+
+    "serial" resizes them one after the other in this process, "pool" hands
+    whole documents to `run_batch` workers and "page-parallel" also splits the
+    documents above `split_threshold` pages into page ranges over the workers.
+
+    Returns:
+        dict: A row with the wall time, pages and MB per second, and the peak RSS
+            (the largest of this process and its workers).
+    """
+    total_bytes = sum(os.path.getsize(document) for document in documents)
+    with tempfile.TemporaryDirectory() as output_path:
+        jobs = [
+            ResizeJob(
+                source_path=document,
+                output_path=os.path.join(output_path, os.path.basename(document)),
+                dimensions=dimensions,
+                tolerance=0.0,
+                split_threshold=split_threshold if mode == "page-parallel" else 0,
+                **options
+            )
+            for document in documents
+        ]
+        start = time.perf_counter()
+        if mode == "serial":
+            results = [resize_document(job) for job in jobs]
+        else:
+            results = list(run_batch(jobs, workers))
+        seconds = time.perf_counter() - start
+    pages = sum(result.pages for result in results)
+    return {
+        "variant": ", ".join([f"mode={mode}", *(f"{key}={value}" for key, value in options.items())]),
+        "pages": pages,
+        "failed": sum(result.status == "failed" for result in results),
+        "seconds": seconds,
+        "pages_per_second": pages / seconds,
+        "mb_per_second": total_bytes / seconds / 1024 / 1024,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def benchmark_modes(
+        documents: List[str],
+        dimensions: tuple[float, float],
+        options: dict,
+        workers: Optional[int]=None,
+        repeat: int=3
+    ) -> List[dict]:
+    """
+    Run `measure_mode` for each mode, `repeat` times, keeping the median run.
+
+    Every run happens in a new process, so the peak RSS of a run is not hidden
+    by the one of an earlier, larger run.
+    """
+    rows = []
+    for mode in MODES:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(1, mp_context=measure_context(), initializer=fork_workers) as executor:
+                runs.append(executor.submit(measure_mode, mode, documents, dimensions, options, workers).result())
+        runs.sort(key=lambda row: row["seconds"])
+        rows.append(runs[len(runs) // 2])
+    return rows
+
+def environment() -> dict:
+    """Describe the code and machine the results come from."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "pypdf": pypdf.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+def compare_rows(rows: List[dict], baseline_path: str) -> None:
+    """Print the change in pages per second of every variant also present in a previous results file."""
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)
+    previous = {(row["suite"], row["variant"]): row for row in baseline["rows"]}
+    print(f'Compared with {baseline_path} ({baseline["environment"]["commit"]}, {baseline["environment"]["timestamp"]}):')
+    for row in rows:
+        old = previous.get((row["suite"], row["variant"]))
+        if old:
+            change = (row["pages_per_second"] / old["pages_per_second"] - 1) * 100
+            color = bcolors.FAIL if change < -5 else bcolors.OKGREEN if change > 5 else ''
+            print(f'{color}{row["suite"]:<12} {row["variant"]:<50} {change:+7.1f}%{bcolors.ENDC}')
+
+def print_rows(rows: List[dict]) -> None:
+    print("{:<50} {:>8} {:>10} {:>12} {:>10} {:>10}".format("Variant", "Pages", "Seconds", "Pages/sec", "MB/sec", "Peak MB"))
+    print("-" * 105)
+    for row in rows:
+        peak = row.get("peak_rss_mb")
+        print("{:<50} {:>8} {:>10.3f} {:>12.1f} {:>10.2f} {:>10}".format(
+            row["variant"], row["pages"], row["seconds"], row["pages_per_second"], row["mb_per_second"],
+            f'{peak:.1f}' if peak is not None else '-'
+        ))
+
+def main(argv: Optional[List[str]]=None) -> None:
+    parser = argparse.ArgumentParser(description='Compare the resize engines, input modes and parallel modes on a folder of PDFs.')
+    parser.add_argument('--corpus', default='../to_convert/', help='folder with the sample PDFs')
+    parser.add_argument('--synthetic', type=int, nargs='*', default=[], metavar='PAGES', help='also generate synthetic documents with these page counts')
+    parser.add_argument('--content', default='mixed', choices=["text", "image", "mixed"], help='content of the synthetic pages')
+    parser.add_argument('--synthetic-dir', default=os.path.join(tempfile.gettempdir(), 'resize_pdf_corpus'), help='where synthetic documents are kept between runs')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, help='worker processes of the pool modes (defaults to the CPU count)')
+    parser.add_argument('--suite', default='all', choices=["all", "engines", "input-modes", "modes"])
+    parser.add_argument('--results', help='write the environment and every row to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--check', action='store_true', help='instead of timing, check that the outputs of every engine, window, optimize and max-dpi combination read back as valid PDFs')
+    arguments = parser.parse_args(argv)
+    if resource is not None:
+        multiprocessing.get_context("forkserver")
+        multiprocessing.forkserver.ensure_running()
+    dimensions = (595.276, 841.89)
+    documents = list_corpus(arguments.corpus) if arguments.corpus else []
+    if arguments.synthetic:
+        print(f'{bcolors.OKBLUE}Generating synthetic documents in {arguments.synthetic_dir}...{bcolors.ENDC}')
+        documents += generate_corpus(arguments.synthetic_dir, arguments.synthetic, arguments.content)
+
+    if arguments.check:
+        failures = check_outputs(documents, dimensions)
+        for failure in failures:
+            print(f'{bcolors.FAIL}{failure}{bcolors.ENDC}')
+        if failures:
+            sys.exit(1)
+        print(f'{bcolors.OKGREEN}Every output of {len(documents)} documents is valid.{bcolors.ENDC}')
+        return
+
+    rows = []
+    if arguments.suite in ("all", "engines"):
+        print(f'{bcolors.OKBLUE}Benchmarking engines on {len(documents)} documents...{bcolors.ENDC}')
+        suite_rows = benchmark_variants(documents, dimensions, ENGINES, arguments.repeat)
+        print_rows(suite_rows)
+        rows += [{"suite": "engines", **row} for row in suite_rows]
+    if arguments.suite in ("all", "input-modes"):
+        print(f'{bcolors.OKBLUE}Benchmarking input modes on {len(documents)} documents...{bcolors.ENDC}')
+        suite_rows = benchmark_variants(documents, dimensions, INPUT_MODES, arguments.repeat)
+        print_rows(suite_rows)
+        rows += [{"suite": "input-modes", **row} for row in suite_rows]
+    if arguments.suite in ("all", "modes"):
+        print(f'{bcolors.OKBLUE}Benchmarking serial, pool and page-parallel modes on {len(documents)} documents...{bcolors.ENDC}')
+        suite_rows = benchmark_modes(documents, dimensions, {"engine": "xobject", "window": 32}, arguments.workers, arguments.repeat)
+        print_rows(suite_rows)
+        rows += [{"suite": "modes", **row} for row in suite_rows]
+
+    if arguments.results:
+        with open(arguments.results, 'w') as file:
+            json.dump({"environment": environment(), "documents": documents, "rows": rows}, file, indent=2)
+        print(f'{bcolors.OKGREEN}Results written to {arguments.results}{bcolors.ENDC}')
+    if arguments.baseline:
+        compare_rows(rows, arguments.baseline)
+
+if __name__ == '__main__':
+    main()
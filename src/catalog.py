@@ -0,0 +1,182 @@
+import json
+import os
+import sqlite3
+import time
+import pypdf
+from pypdf.generic import RectangleObject
+from multiprocessing import Pool, cpu_count
+from typing import Iterable, List, Optional
+from discovery import RetrievedFilesType
+from engine import matches_dimensions
+from streaming import iter_page_references
+from utils.source import open_source, source_digest
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT,
+    pages INTEGER,
+    page_sizes TEXT,
+    error TEXT,
+    probed_at REAL NOT NULL
+)
+"""
+
+def size_key(width: float, height: float) -> str:
+    return f'{width:.1f}x{height:.1f}'
+
+def parse_size_key(key: str) -> tuple[float, float]:
+    width, height = key.split('x')
+    return float(width), float(height)
+
+def probe_document(path: str) -> dict:
+    """
+    Read the metadata of a source without touching its content streams.
+
+    The file is read once for its sha256 and its page tree walked for the
+    mediabox of every page (see streaming.iter_page_references): page
+    dictionaries only, no content, font or image is decoded.
+
+    Returns:
+        dict: The row of the document: size, mtime_ns, sha256, pages and the
+            histogram of page sizes {"595.3x841.9": count}, or the error when
+            the file cannot be parsed.
+    """
+    stat = os.stat(path)
+    row = {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": None, "pages": None, "page_sizes": None, "error": None}
+    try:
+        with open_source(path, "mmap") as source:
+            row["sha256"] = source_digest(source)
+            reader = pypdf.PdfReader(source)
+            page_sizes: dict[str, int] = {}
+            for reference, inherited in iter_page_references(reader):
+                page = reference.get_object()
+                box = RectangleObject(page["/MediaBox"] if "/MediaBox" in page else inherited["/MediaBox"].get_object())
+                key = size_key(float(box.width), float(box.height))
+                page_sizes[key] = page_sizes.get(key, 0) + 1
+            row["pages"] = sum(page_sizes.values())
+            row["page_sizes"] = page_sizes
+    except Exception as error:
+        row["error"] = f'{type(error).__name__}: {error}'
+    return row
+
+class MetadataCatalog:
+    """
+    SQLite index of the sources: size, mtime, content hash, page count and
+    histogram of page sizes.
+
+    Rows are refreshed by `update` only for the files whose size or mtime
+    changed, so keeping the index of a whole share current costs one stat
+    per file plus a probe per new or edited file. The rows then answer
+    planning questions and let a batch route documents without parsing them.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.__path = path
+        self.__connection = sqlite3.connect(path)
+        self.__connection.execute(SCHEMA)
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def close(self) -> None:
+        self.__connection.close()
+
+    def get(self, doc: RetrievedFilesType) -> Optional[dict]:
+        """The row of `doc`, None when it is not indexed or changed since."""
+        cursor = self.__connection.execute(
+            'SELECT path, size, mtime_ns, sha256, pages, page_sizes, error FROM documents WHERE path = ?', (doc.path,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        path, size, mtime_ns, sha256, pages, page_sizes, error = row
+        # The records carry st_mtime as a float, precise to the microsecond
+        if size != doc.size or abs(mtime_ns / 1e9 - doc.last_modified_at) > 1e-6:
+            return None
+        return {
+            "path": path,
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "sha256": sha256,
+            "pages": pages,
+            "page_sizes": json.loads(page_sizes) if page_sizes else None,
+            "error": error
+        }
+
+    def stale(self, docs: Iterable[RetrievedFilesType]) -> List[RetrievedFilesType]:
+        return [doc for doc in docs if self.get(doc) is None]
+
+    def update(self, docs: Iterable[RetrievedFilesType], workers: Optional[int]=None) -> int:
+        """
+        Probe the new or changed documents in a process pool and store their rows.
+
+        Returns:
+            int: The number of documents probed.
+        """
+        stale_docs = self.stale(docs)
+        if not stale_docs:
+            return 0
+        paths = [doc.path for doc in stale_docs]
+        workers = min(workers or cpu_count(), len(paths))
+        if workers == 1:
+            rows = map(probe_document, paths)
+            self.__store(rows)
+        else:
+            with Pool(workers) as pool:
+                self.__store(pool.imap_unordered(probe_document, paths, chunksize=4))
+        return len(paths)
+
+    def __store(self, rows: Iterable[dict]) -> None:
+        with self.__connection:
+            self.__connection.executemany(
+                'INSERT OR REPLACE INTO documents VALUES (:path, :size, :mtime_ns, :sha256, :pages, :page_sizes, :error, :probed_at)',
+                ({**row, "page_sizes": json.dumps(row["page_sizes"]) if row["page_sizes"] else None, "probed_at": time.time()} for row in rows)
+            )
+
+def is_sized(row: dict, dimensions: tuple[float, float], tolerance: float) -> bool:
+    """Whether every page of an indexed document already has `dimensions`."""
+    return bool(row["page_sizes"]) and all(
+        matches_dimensions(parse_size_key(key), dimensions, tolerance) for key in row["page_sizes"]
+    )
+
+def plan_batch(rows: Iterable[Optional[dict]], dimensions: tuple[float, float], tolerance: float) -> dict:
+    """
+    Answer what a batch to `dimensions` would do, from the catalog rows alone.
+
+    Returns:
+        dict: Documents and pages in total, already in the format (copied as
+            they are) and to scale, the unreadable documents and the page
+            sizes of the pages to scale, largest count first.
+    """
+    summary = {
+        "documents": 0, "pages": 0,
+        "sized_documents": 0, "sized_pages": 0,
+        "documents_to_scale": 0, "pages_to_scale": 0,
+        "unreadable": 0, "unindexed": 0,
+        "sizes_to_scale": {}
+    }
+    for row in rows:
+        summary["documents"] += 1
+        if row is None:
+            summary["unindexed"] += 1
+            continue
+        if row["error"]:
+            summary["unreadable"] += 1
+            continue
+        summary["pages"] += row["pages"]
+        if is_sized(row, dimensions, tolerance):
+            summary["sized_documents"] += 1
+        else:
+            summary["documents_to_scale"] += 1
+        for key, count in (row["page_sizes"] or {}).items():
+            if matches_dimensions(parse_size_key(key), dimensions, tolerance):
+                summary["sized_pages"] += count
+            else:
+                summary["pages_to_scale"] += count
+                summary["sizes_to_scale"][key] = summary["sizes_to_scale"].get(key, 0) + count
+    summary["sizes_to_scale"] = dict(sorted(summary["sizes_to_scale"].items(), key=lambda item: -item[1]))
+    return summary
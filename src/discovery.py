@@ -0,0 +1,129 @@
+from dataclasses import dataclass
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Literal, Sequence, Union
+
+OrderBy = Literal["creation_date", "last_modification_date", "name"]
+
+@dataclass(slots=True)
+class RetrievedFilesType:
+    name: str
+    path: str
+    created_at: float
+    last_modified_at: float
+    size: int = 0
+
+def stat_document(path: str) -> RetrievedFilesType:
+    """
+    Build the record of a single file with one stat call.
+    """
+    stat = os.stat(path)
+    return RetrievedFilesType(
+        name=os.path.basename(path),
+        path=path,
+        created_at=stat.st_ctime,
+        last_modified_at=stat.st_mtime,
+        size=stat.st_size
+    )
+
+# Concurrent checks of the pre-flight validation, each one mostly waits on the share
+VALIDATION_THREADS = 32
+
+def check_document(path: str) -> Union[RetrievedFilesType, str]:
+    """
+    Check that `path` exists, is not empty and starts like a PDF (the header may
+    follow up to 1 KB of garbage).
+
+    Returns:
+        RetrievedFilesType | str: The record of the file, or why it is invalid.
+    """
+    try:
+        doc = stat_document(path)
+        if doc.size == 0:
+            return 'empty file'
+        with open(path, 'rb') as file:
+            if b'%PDF-' not in file.read(1024):
+                return 'no PDF header'
+        return doc
+    except FileNotFoundError:
+        return 'not found'
+    except OSError as error:
+        return f'{type(error).__name__}: {error.strerror or error}'
+
+def validate_documents(
+        paths: Sequence[str],
+        threads: int=VALIDATION_THREADS
+    ) -> tuple[List[RetrievedFilesType], List[tuple[str, str]]]:
+    """
+    Check every path of an order file concurrently, see `check_document`.
+
+    On a network share each check is a few round trips, so running them in
+    threads hides the latency instead of paying it once per line.
+
+    Returns:
+        tuple: The records of the valid files and the (path, reason) of the
+            invalid ones, both in the order of `paths`.
+    """
+    valid, invalid = [], []
+    with ThreadPoolExecutor(max(1, min(threads, len(paths)))) as executor:
+        for path, checked in zip(paths, executor.map(check_document, paths)):
+            if isinstance(checked, str):
+                invalid.append((path, checked))
+            else:
+                valid.append(checked)
+    return valid, invalid
+
+def scan_documents(root: str, extension: str='pdf', recursive: bool=False) -> Iterator[RetrievedFilesType]:
+    """
+    List the files of `root` with the given extension using os.scandir.
+
+    The stat data comes from the directory entries: on Windows (the J: share)
+    it is already part of the listing, so no extra request is made per file;
+    elsewhere each file costs a single stat instead of one per attribute.
+
+    Args:
+        root (str): Folder to scan.
+        extension (str): File extension to keep, case insensitive.
+        recursive (bool): Also scan the sub folders (curso/em_andamento/turma...).
+
+    Yields:
+        RetrievedFilesType: One record per matching file, in directory order.
+    """
+    suffix = f'.{extension.lower()}'
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        folders.append(entry.path)
+                elif entry.name.lower().endswith(suffix) and entry.is_file():
+                    stat = entry.stat()
+                    yield RetrievedFilesType(
+                        name=entry.name,
+                        path=entry.path,
+                        created_at=stat.st_ctime,
+                        last_modified_at=stat.st_mtime,
+                        size=stat.st_size
+                    )
+
+SORT_KEYS = {
+    "name": lambda doc: doc.name,
+    "creation_date": lambda doc: doc.created_at,
+    "last_modification_date": lambda doc: doc.last_modified_at
+}
+
+def sort_documents(documents: Iterable[RetrievedFilesType], order_by: OrderBy) -> List[RetrievedFilesType]:
+    """
+    Sort the records in a single pass on a numeric or name key.
+    """
+    key = SORT_KEYS.get(order_by)
+    return sorted(documents, key=key) if key else list(documents)
+
+def write_order(path: str, documents: Iterable[RetrievedFilesType], complete_path: bool=True) -> None:
+    """
+    Stream the records into an order file, one per line.
+    """
+    with open(path, 'w') as file:
+        file.writelines(f'{doc.path if complete_path else doc.name}\n' for doc in documents)
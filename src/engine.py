@@ -0,0 +1,860 @@
+from dataclasses import dataclass, field, replace
+import io
+import math
+import mmap
+import os
+import queue
+import re
+import shutil
+import time
+import pypdf
+from itertools import islice
+from images import downsample_page
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Literal, Optional, Union
+from multiprocessing import cpu_count
+from pypdf.generic import NameObject
+from streaming import OPTIMIZE_LEVELS, Optimize, StreamingPdfWriter, append_pages, stream_pages, write_pages
+from transforms import Engine, FitMode, scale_page, wrap_page, writer_register
+from utils.fastcopy import PARTIAL_SUFFIX, LinkMode, atomic_output, clone_file
+from utils.memory import MB
+from utils.profiling import checkpoint, combine, profile_call
+from utils.source import InputMode, open_source, source_digest
+from workers import MemoryLimits, WorkerLost, WorkerPool
+
+@dataclass(frozen=True)
+class ResizeJob:
+    """Immutable description of a single resize job.
+
+    Only plain values live here so the job can be pickled and shipped to a
+    worker process without dragging a ResizePDF instance along.
+    """
+    source_path: str
+    output_path: str
+    dimensions: tuple[float, float]
+    page_range: Optional[tuple[int, int]] = None
+    split_threshold: int = 0
+    hash_source: bool = False
+    tolerance: float = 1.0
+    link_mode: LinkMode = "reflink"
+    engine: Engine = "scale"
+    fit: FitMode = "stretch"
+    window: int = 0
+    input_mode: InputMode = "buffered"
+    page_metrics: bool = False
+    profile: bool = False
+    optimize: Optimize = "none"
+    max_dpi: int = 0
+    jpeg_quality: int = 80
+    # Page count of a source the metadata catalog knows is already in the size, 0 when unknown
+    known_sized_pages: int = 0
+    # Page count of the source known before it is opened (catalog, largest-first probe), 0 when unknown
+    source_pages: int = 0
+
+    @property
+    def keeps_sized_source(self) -> bool:
+        """Whether a source already in the size is its own output: no image to downsample, nothing to optimize."""
+        return not self.max_dpi and self.optimize == "none"
+
+@dataclass(frozen=True)
+class StitchJob:
+    """Concatenate the part files of a split document, in order, into its output."""
+    part_paths: tuple[str, ...]
+    output_path: str
+    optimize: Optimize = "none"
+
+@dataclass(frozen=True)
+class MergeJob:
+    """Resize several documents into a single output, in the order of `jobs`."""
+    jobs: tuple[ResizeJob, ...]
+    output_path: str
+
+# A document held in memory or a readable binary file object
+PdfInput = Union[bytes, bytearray, memoryview, BinaryIO]
+
+# Part files of a split document, next to its output
+PART_SUFFIX_FORMAT = '.part{}'
+PART_SUFFIX = re.compile(r'\.part\d+$')
+
+# Pages held in memory at once while merging, when the jobs do not set `window`
+MERGE_WINDOW = 64
+
+@dataclass(frozen=True)
+class FanOutJob:
+    """Resize one source to several formats: `jobs` share the source and differ in output and dimensions."""
+    jobs: tuple[ResizeJob, ...]
+
+    @property
+    def source_path(self) -> str:
+        return self.jobs[0].source_path
+
+    @property
+    def source_pages(self) -> int:
+        return self.jobs[0].source_pages
+
+def with_source_pages(job: Union[ResizeJob, FanOutJob], pages: int) -> Union[ResizeJob, FanOutJob]:
+    """`job` carrying the page count of its source, see ResizeJob.source_pages."""
+    if isinstance(job, FanOutJob):
+        return FanOutJob(tuple(replace(part, source_pages=pages) for part in job.jobs))
+    return replace(job, source_pages=pages)
+
+@dataclass
+class ResizeResult:
+    """Outcome of a resize job, returned from the worker to the parent."""
+    source_path: str
+    output_path: str
+    status: Literal["done", "failed", "split"]
+    pages: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    timings: dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+    source_sha256: Optional[str] = None
+    # mtime of the source when it was converted, recorded with `bytes_in` so the
+    # parent never stats a source that may be gone by the time the result is in
+    source_mtime_ns: Optional[int] = None
+    passthrough: Optional[LinkMode] = None
+    page_timings: List[float] = field(default_factory=list)
+    profile: Optional[dict] = None
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.source_path)
+
+def matches_dimensions(
+        original_dimension: tuple[float, float],
+        desired_dimension: tuple[float, float],
+        tolerance: float
+    ) -> bool:
+    """
+    Check whether a page size equals the desired one, within `tolerance` points on each side.
+
+    Scanners write A4 as 595 x 842 or 595.28 x 841.89 while the desired A4 is
+    595.276 x 841.89, so an exact comparison almost never holds.
+    """
+    return (
+        abs(original_dimension[0] - desired_dimension[0]) <= tolerance
+        and abs(original_dimension[1] - desired_dimension[1]) <= tolerance
+    )
+
+def page_dimension(page: pypdf.PageObject) -> tuple[float, float]:
+    return float(page.mediabox.width), float(page.mediabox.height)
+
+def resize_pages(
+        pages: Iterable[pypdf.PageObject],
+        writer: pypdf.PdfWriter,
+        dimensions: tuple[float, float],
+        tolerance: float=0.0,
+        engine: Engine="scale",
+        fit: FitMode="stretch",
+        page_timings: Optional[List[float]]=None,
+        max_dpi: int=0,
+        jpeg_quality: int=80
+    ) -> int:
+    """
+    Resize every page in `pages` to `dimensions` and add it to `writer`.
+
+    Pages already within `tolerance` points of the target are added unchanged.
+
+    Args:
+        engine (Engine): "scale" rewrites each content stream with pypdf's `scale()`,
+            "xobject" wraps each page as a form XObject placed with a single matrix.
+        fit (FitMode): "stretch" or "fit" (keep the aspect ratio and center),
+            the latter only with the "xobject" engine.
+        page_timings (List[float], optional): Receives the seconds spent on each page.
+        max_dpi (int): Downsample the images shown above this resolution on the
+            resized page (see images.downsample_page), 0 keeps them as they are.
+        jpeg_quality (int): Quality of the JPEG images encoded again.
+
+    Returns:
+        int: The number of pages written.
+    """
+    if engine == "scale" and fit != "stretch":
+        raise ValueError('The "fit" mode needs the "xobject" engine.')
+    register = writer_register(writer)
+    count = 0
+    for page in pages:
+        start = time.perf_counter()
+        if matches_dimensions(page_dimension(page), dimensions, tolerance):
+            resized = writer.add_page(page)
+        elif engine == "xobject":
+            resized = writer.add_page(wrap_page(page, dimensions, fit, register))
+        else:
+            # Scaling the writer's copy leaves the source page intact for another format;
+            # the rewritten content stream would otherwise be written uncompressed
+            resized = scale_page(writer.add_page(page), dimensions)
+            resized.compress_content_streams()
+        if max_dpi:
+            downsample_page(resized, max_dpi, jpeg_quality)
+        if page_timings is not None:
+            page_timings.append(time.perf_counter() - start)
+        count += 1
+    return count
+
+def page_transform(
+        job: ResizeJob,
+        page_timings: Optional[List[float]]=None
+    ) -> Callable[[pypdf.PageObject, Callable], pypdf.PageObject]:
+    """
+    Return the per-page transform of `job` in the form `stream_pages` expects.
+
+    Images are downsampled on the source page, against the size it is resized
+    to: the objects of a page wrapped by the "xobject" engine are references
+    into the streaming writer, which cannot be resolved until written.
+
+    Args:
+        page_timings (List[float], optional): Receives the seconds spent on each page.
+    """
+    def transform(page: pypdf.PageObject, register: Callable) -> pypdf.PageObject:
+        start = time.perf_counter()
+        sized = matches_dimensions(page_dimension(page), job.dimensions, job.tolerance)
+        if job.max_dpi:
+            downsample_page(page, job.max_dpi, job.jpeg_quality, None if sized else job.dimensions)
+        if sized:
+            resized = page
+        elif job.engine == "xobject":
+            resized = wrap_page(page, job.dimensions, job.fit, register)
+        else:
+            # The rewritten content stream would otherwise be written uncompressed, as in `resize_pages`
+            resized = scale_page(page, job.dimensions)
+            resized[NameObject("/Contents")] = resized.get_contents().flate_encode()
+        if page_timings is not None:
+            page_timings.append(time.perf_counter() - start)
+        return resized
+    return transform
+
+def split_job(job: ResizeJob, page_count: int, pages_per_range: int) -> List[ResizeJob]:
+    """
+    Split a document job into page-range jobs that write to temporary part files.
+
+    Args:
+        job (ResizeJob): The job of the whole document.
+        page_count (int): Number of pages in the document.
+        pages_per_range (int): Number of pages handled by each part.
+
+    Returns:
+        List[ResizeJob]: One job per range, in page order.
+    """
+    return [
+        replace(
+            job,
+            output_path=f'{job.output_path}{PART_SUFFIX_FORMAT.format(index)}',
+            page_range=(start, min(start + pages_per_range, page_count)),
+            split_threshold=0,
+            hash_source=False
+        )
+        for index, start in enumerate(range(0, page_count, pages_per_range))
+    ]
+
+def stitch_parts(job: StitchJob) -> ResizeResult:
+    """
+    Join the part files of a split document into its final output and remove the parts.
+
+    Every part carries its own copy of the resources its pages share with
+    the other parts (fonts, letterheads), so the output is written at least
+    at the "dedup" optimization level, which stores them once again.
+
+    Never raises, the outcome is reported through the returned ResizeResult.
+    """
+    result = ResizeResult(source_path=job.output_path, output_path=job.output_path, status="failed")
+    start = time.perf_counter()
+    optimize = job.optimize if OPTIMIZE_LEVELS.index(job.optimize) >= OPTIMIZE_LEVELS.index("dedup") else "dedup"
+    try:
+        readers = [pypdf.PdfReader(part_path) for part_path in job.part_paths]
+        with atomic_output(job.output_path) as output_file:
+            write_pages((page for reader in readers for page in reader.pages), output_file, optimize)
+        result.bytes_out = os.path.getsize(job.output_path)
+        result.status = "done"
+    except Exception as error:
+        result.error = f'{type(error).__name__}: {error}'
+    finally:
+        remove_parts(job.part_paths)
+    result.timings["stitch"] = time.perf_counter() - start
+    return result
+
+def remove_parts(part_paths: Iterable[str]) -> None:
+    for part_path in part_paths:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+def remove_leftovers(folder: str, recursive: bool=False) -> int:
+    """
+    Remove what an interrupted batch left in an output folder: the part files
+    of split documents and the temporary files of unfinished outputs.
+
+    Returns:
+        int: The number of files removed.
+    """
+    removed = 0
+    folders = [folder]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        folders.append(entry.path)
+                elif entry.name.endswith(PARTIAL_SUFFIX) or PART_SUFFIX.search(entry.name):
+                    os.remove(entry.path)
+                    removed += 1
+    return removed
+
+def prepare_output(
+        job: ResizeJob,
+        source: Union[BinaryIO, mmap.mmap],
+        result: ResizeResult
+    ) -> Optional[Callable[[BinaryIO], int]]:
+    """
+    Parse and transform an opened source, leaving only the write to do.
+
+    Fills the page count, the source digest and the "read" and "transform"
+    timings of `result`. With `job.window` set the pages are transformed while
+    they are streamed to the output, so the work ends up in the "write" timing.
+
+    Args:
+        job (ResizeJob): The job being executed.
+        source (BinaryIO | mmap): The opened source document, see utils.source.open_source.
+        result (ResizeResult): The result of the job, updated in place.
+
+    Returns:
+        Callable, optional: Writes the resized document to a binary stream and returns
+            the number of pages written. None when nothing has to be written: either the
+            document must be split (status "split") or every page already has the
+            desired size and the source itself is the output.
+    """
+    start = time.perf_counter()
+    if job.hash_source:
+        result.source_sha256 = source_digest(source)
+    return prepare_pages(job, pypdf.PdfReader(source), result, start)
+
+def prepare_pages(
+        job: ResizeJob,
+        reader: pypdf.PdfReader,
+        result: ResizeResult,
+        start: Optional[float]=None
+    ) -> Optional[Callable[[BinaryIO], int]]:
+    """
+    The part of `prepare_output` after the source is opened: `resize_fanout`
+    runs it once per format on the same reader.
+
+    Args:
+        start (float, optional): perf_counter value the "read" timing starts from.
+            Defaults to now.
+    """
+    start = start or time.perf_counter()
+    page_count = len(reader.pages)
+    if job.page_range is None and job.split_threshold and page_count > job.split_threshold:
+        result.status = "split"
+        result.pages = page_count
+        result.timings["read"] = time.perf_counter() - start
+        return None
+    pages = reader.pages if job.page_range is None else reader.pages[job.page_range[0]:job.page_range[1]]
+    already_sized = job.page_range is None and job.keeps_sized_source and all(
+        matches_dimensions(page_dimension(page), job.dimensions, job.tolerance) for page in pages
+    )
+    read_done = time.perf_counter()
+    result.timings["read"] = read_done - start
+    result.timings["transform"] = 0.0
+    if already_sized:
+        result.pages = page_count
+        return None
+    page_timings = result.page_timings if job.page_metrics else None
+    if job.window:
+        return lambda output: stream_pages(reader, output, page_transform(job, page_timings), job.window, job.page_range, job.optimize)
+    writer = pypdf.PdfWriter()
+    result.pages = resize_pages(
+        pages, writer, job.dimensions, job.tolerance, job.engine, job.fit, page_timings, job.max_dpi, job.jpeg_quality
+    )
+    result.timings["transform"] = time.perf_counter() - read_done
+    checkpoint()
+    def write(output: BinaryIO) -> int:
+        if job.optimize == "none":
+            writer.write(output)
+        else:
+            write_pages(writer.pages, output, job.optimize)
+        return result.pages
+    return write
+
+def resize_document(job: ResizeJob) -> ResizeResult:
+    """
+    Resize a single document described by `job`.
+
+    This is the worker entry point of the batch engine. It never raises: any
+    error is reported back through the returned ResizeResult so one broken
+    file does not take the whole batch down.
+
+    When the document has more pages than `job.split_threshold` nothing is
+    written and the result comes back with status "split", so the caller can
+    fan the document out as page-range jobs.
+
+    When every page already has the desired size, and the job neither
+    downsamples images nor optimizes, the source is cloned to the output byte
+    for byte without a PdfWriter round trip. With `job.known_sized_pages` set
+    the source is then cloned without being parsed at all.
+
+    With `job.window` set the pages are streamed to the output that many at a
+    time (see streaming.stream_pages), so memory does not grow with the
+    document; the "write" timing then includes the transform.
+
+    With `job.profile` set the job runs under cProfile and tracemalloc and
+    the result carries the profile (see utils.profiling.profile_call).
+
+    Args:
+        job (ResizeJob): The job to execute.
+
+    Returns:
+        ResizeResult: Status, page count, byte counts and timings of the job.
+    """
+    if job.profile:
+        result, profile = profile_call(resize_document, replace(job, profile=False))
+        result.profile = profile
+        return result
+    result = ResizeResult(source_path=job.source_path, output_path=job.output_path, status="failed")
+    start = time.perf_counter()
+    try:
+        stat = os.stat(job.source_path)
+        result.bytes_in, result.source_mtime_ns = stat.st_size, stat.st_mtime_ns
+        with open_source(job.source_path, job.input_mode) as source:
+            opened = time.perf_counter()
+            if job.known_sized_pages and job.keeps_sized_source:
+                if job.hash_source:
+                    result.source_sha256 = source_digest(source)
+                result.pages = job.known_sized_pages
+                result.timings["read"] = result.timings["transform"] = 0.0
+                render = None
+            else:
+                render = prepare_output(job, source, result)
+            result.timings["read"] += opened - start
+            if result.status == "split":
+                return result
+            write_start = time.perf_counter()
+            if render is None:
+                result.passthrough = clone_file(job.source_path, job.output_path, job.link_mode)
+            else:
+                with atomic_output(job.output_path) as output_file:
+                    result.pages = render(output_file)
+        result.timings["write"] = time.perf_counter() - write_start
+        result.bytes_out = os.path.getsize(job.output_path)
+        result.status = "done"
+    except Exception as error:
+        result.error = f'{type(error).__name__}: {error}'
+    result.timings["total"] = time.perf_counter() - start
+    return result
+
+class _CountingWriter:
+    """
+    Write-only wrapper counting the bytes written, for outputs that cannot `tell`.
+
+    pypdf only needs `write` and `tell` from its output, and the offsets it
+    takes from `tell` must count from the start of the document anyway.
+    """
+
+    def __init__(self, output: BinaryIO) -> None:
+        self.__output = output
+        self.__written = 0
+
+    def write(self, data: bytes) -> int:
+        self.__output.write(data)
+        self.__written += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.__written
+
+def input_stream(source: PdfInput) -> BinaryIO:
+    """
+    Seekable binary stream over a document held in memory or a file-like object.
+
+    bytes are wrapped without a copy, bytearray and memoryview are copied once.
+    A file object is used as it is when it can seek, otherwise read whole.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if source.seekable():
+        return source
+    return io.BytesIO(source.read())
+
+def resize_stream(job: ResizeJob, source: PdfInput, output: BinaryIO) -> ResizeResult:
+    """
+    Resize a document held in memory or read from a file-like object into `output`,
+    without touching the file system.
+
+    The paths of `job` are only used as labels and documents are never split.
+    A document already in the size is copied to `output` as it is (see
+    `ResizeJob.keeps_sized_source`). `output` only needs a `write` method:
+    a socket or a response body will do.
+    Unlike `resize_document` errors are raised.
+
+    Returns:
+        ResizeResult: Page count, byte counts and timings of the job.
+    """
+    start = time.perf_counter()
+    stream = input_stream(source)
+    result = ResizeResult(source_path=job.source_path, output_path=job.output_path, status="failed")
+    result.bytes_in = stream.seek(0, io.SEEK_END)
+    stream.seek(0)
+    render = prepare_output(replace(job, split_threshold=0), stream, result)
+    write_start = time.perf_counter()
+    if render is None:
+        stream.seek(0)
+        shutil.copyfileobj(stream, output)
+        result.passthrough = "copy"
+        result.bytes_out = result.bytes_in
+    else:
+        counter = _CountingWriter(output)
+        result.pages = render(counter)
+        result.bytes_out = counter.tell()
+    result.timings["write"] = time.perf_counter() - write_start
+    result.status = "done"
+    result.timings["total"] = time.perf_counter() - start
+    return result
+
+def resize_buffer(job: ResizeJob, data: PdfInput) -> tuple[ResizeResult, bytes]:
+    """
+    Resize a document held in memory, without touching the file system (see `resize_stream`).
+
+    Like `resize_document` it never raises.
+
+    Returns:
+        tuple[ResizeResult, bytes]: The result and the resized document, empty on failure.
+    """
+    output = io.BytesIO()
+    try:
+        result = resize_stream(job, data, output)
+    except Exception as error:
+        result = ResizeResult(source_path=job.source_path, output_path=job.output_path, status="failed")
+        result.error = f'{type(error).__name__}: {error}'
+        return result, b''
+    return result, output.getvalue()
+
+def resize_fanout(job: FanOutJob) -> List[ResizeResult]:
+    """
+    Resize one source to every format of `job`, opening, hashing and parsing it once.
+
+    Pages are added to each format's writer before being scaled (see
+    `resize_pages`), so the parsed source stays intact from one format to the
+    next. With `window` set each format streams the source again, the reader
+    cache being dropped as the windows go; only the open and the
+    cross-reference table are shared then. Documents are never split here.
+    Like `resize_document` it never raises.
+
+    Returns:
+        List[ResizeResult]: One result per format, in the order of `job.jobs`.
+    """
+    results = [ResizeResult(source_path=part.source_path, output_path=part.output_path, status="failed") for part in job.jobs]
+    try:
+        stat = os.stat(job.source_path)
+        with open_source(job.source_path, job.jobs[0].input_mode) as source:
+            start = time.perf_counter()
+            sha256 = source_digest(source) if any(part.hash_source for part in job.jobs) else None
+            reader = pypdf.PdfReader(source)
+            for part, result in zip(job.jobs, results):
+                result.bytes_in, result.source_mtime_ns = stat.st_size, stat.st_mtime_ns
+                result.source_sha256 = sha256
+                try:
+                    render = prepare_pages(replace(part, split_threshold=0), reader, result, start)
+                    write_start = time.perf_counter()
+                    if render is None:
+                        result.passthrough = clone_file(part.source_path, part.output_path, part.link_mode)
+                    else:
+                        with atomic_output(part.output_path) as output_file:
+                            result.pages = render(output_file)
+                    result.timings["write"] = time.perf_counter() - write_start
+                    result.bytes_out = os.path.getsize(part.output_path)
+                    result.status = "done"
+                except Exception as error:
+                    result.error = f'{type(error).__name__}: {error}'
+                result.timings["total"] = time.perf_counter() - start
+                start = time.perf_counter()
+    except Exception as error:
+        for result in results:
+            if result.status != "done":
+                result.error = f'{type(error).__name__}: {error}'
+    return results
+
+def merge_documents(job: MergeJob) -> ResizeResult:
+    """
+    Resize the documents of `job` and stream them, in order, into one output.
+
+    Each source is read once and its pages written as soon as they are
+    resized (see streaming.append_pages), so nothing written is read again
+    and memory stays bounded by a window of pages. The output is written at
+    least at the "dedup" optimization level: a stream embedded by several
+    sources (a letterhead, a stamp, a font) is stored once.
+
+    Every source must succeed: on the first failure nothing is written (the
+    output is renamed into place once complete) and the error names the
+    source. Like `resize_document` it never raises.
+
+    Returns:
+        ResizeResult: The result of the merged output, `bytes_in` summing the sources.
+    """
+    result = ResizeResult(source_path=job.output_path, output_path=job.output_path, status="failed")
+    start = time.perf_counter()
+    optimize = max((document.optimize for document in job.jobs), key=OPTIMIZE_LEVELS.index, default="none")
+    optimize = optimize if OPTIMIZE_LEVELS.index(optimize) >= OPTIMIZE_LEVELS.index("dedup") else "dedup"
+    source_path = None
+    try:
+        with atomic_output(job.output_path) as output_file:
+            writer = StreamingPdfWriter(output_file, optimize)
+            for document in job.jobs:
+                source_path = document.source_path
+                result.bytes_in += os.path.getsize(source_path)
+                page_timings = result.page_timings if document.page_metrics else None
+                with open_source(source_path, document.input_mode) as source:
+                    reader = pypdf.PdfReader(source)
+                    append_pages(writer, reader, page_transform(document, page_timings), document.window or MERGE_WINDOW)
+                    writer.release(reader)
+            source_path = None
+            writer.close()
+        result.pages = writer.page_count
+        result.bytes_out = os.path.getsize(job.output_path)
+        result.status = "done"
+    except Exception as error:
+        result.error = f'{os.path.basename(source_path)}: ' if source_path else ''
+        result.error += f'{type(error).__name__}: {error}'
+    result.timings["total"] = time.perf_counter() - start
+    return result
+
+def execute(tasks: tuple[Union[ResizeJob, FanOutJob, StitchJob], ...]) -> List[ResizeResult]:
+    """Worker entry point for a chunk of resize, fan-out or stitch tasks."""
+    results = []
+    for task in tasks:
+        if isinstance(task, StitchJob):
+            results.append(stitch_parts(task))
+        elif isinstance(task, FanOutJob):
+            results.extend(resize_fanout(task))
+        else:
+            results.append(resize_document(task))
+    return results
+
+def lost_results(tasks: tuple[Union[ResizeJob, FanOutJob, StitchJob], ...], error: WorkerLost) -> List[ResizeResult]:
+    """Failed results standing for the tasks of a worker that died."""
+    return [
+        ResizeResult(source_path=getattr(part, "source_path", part.output_path), output_path=part.output_path, status="failed", error=str(error))
+        for task in tasks
+        for part in (task.jobs if isinstance(task, FanOutJob) else (task,))
+    ]
+
+def is_large(job: Union[ResizeJob, FanOutJob], limits: MemoryLimits) -> bool:
+    """
+    Whether the source of a job passes the size or page count threshold of the large lane.
+
+    The page count is the one the job carries (`source_pages`): the dispatch
+    loop never opens a source, one whose count is unknown is judged by its size.
+    """
+    if isinstance(job, ResizeJob) and job.page_range is not None:
+        return False
+    try:
+        size = os.path.getsize(job.source_path)
+    except OSError:
+        return False
+    if limits.large_mb and size > limits.large_mb * MB:
+        return True
+    return bool(limits.large_pages) and job.source_pages > limits.large_pages
+
+class _SplitDocument:
+    """Bookkeeping for a document that was fanned out into page ranges."""
+
+    def __init__(self, result: ResizeResult, parts: List[ResizeJob]) -> None:
+        self.result = result
+        self.parts = parts
+        self.part_results: List[ResizeResult] = []
+
+    def add_part_result(self, part_result: ResizeResult) -> bool:
+        """Record a finished part, returning True once every part is in."""
+        self.part_results.append(part_result)
+        return len(self.part_results) == len(self.parts)
+
+    def failed(self) -> bool:
+        return any(part_result.status == "failed" for part_result in self.part_results)
+
+    def stitch_job(self) -> StitchJob:
+        return StitchJob(
+            part_paths=tuple(part.output_path for part in self.parts),
+            output_path=self.result.output_path,
+            optimize=self.parts[0].optimize
+        )
+
+    def finish(self, stitch_result: Optional[ResizeResult]=None) -> ResizeResult:
+        """Fold the part results (and the stitch result, if any) into the document result."""
+        result = self.result
+        result.status = "done"
+        result.timings = {}
+        order = {part.output_path: index for index, part in enumerate(self.parts)}
+        result.profile = combine(part_result.profile for part_result in self.part_results if part_result.profile)
+        for part_result in sorted(self.part_results, key=lambda part_result: order[part_result.output_path]):
+            result.page_timings.extend(part_result.page_timings)
+            for stage, seconds in part_result.timings.items():
+                result.timings[stage] = result.timings.get(stage, 0.0) + seconds
+            if part_result.status == "failed":
+                result.status = "failed"
+                result.error = part_result.error
+        if stitch_result is None:
+            remove_parts(part.output_path for part in self.parts)
+        else:
+            result.timings.update(stitch_result.timings)
+            result.bytes_out = stitch_result.bytes_out
+            if stitch_result.status == "failed":
+                result.status = "failed"
+                result.error = stitch_result.error
+        return result
+
+class BatchEngine:
+    """
+    Persistent process pool running resize jobs.
+
+    Documents whose worker reports them as "split" are fanned out as page
+    ranges and stitched back transparently: `wait` only ever returns the
+    result of whole documents. Memory is governed by `limits` (see
+    workers.WorkerPool): jobs whose source passes the size or page threshold
+    run in the large lane, and a document whose worker was killed comes back
+    failed. Use it as a context manager.
+    """
+
+    def __init__(
+            self,
+            workers: Optional[int]=None,
+            pages_per_range: Optional[int]=None,
+            limits: MemoryLimits=MemoryLimits()
+        ) -> None:
+        self.__workers = workers or cpu_count()
+        self.__pages_per_range = pages_per_range
+        self.__limits = limits
+        self.__pool: Optional[WorkerPool] = None
+        self.__submitted: dict[str, ResizeJob] = {}
+        self.__split_parts: dict[str, _SplitDocument] = {}
+        self.__stitching: dict[str, _SplitDocument] = {}
+        self.__in_flight = 0
+
+    @property
+    def workers(self) -> int:
+        return self.__workers
+
+    @property
+    def in_flight(self) -> int:
+        """Number of tasks handed to the pool that have not come back yet."""
+        return self.__in_flight
+
+    def __enter__(self) -> 'BatchEngine':
+        self.__pool = WorkerPool(execute, self.__workers, self.__limits)
+        self.__pool.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.__pool.close()
+        else:
+            self.__pool.terminate()
+
+    @property
+    def starved(self) -> bool:
+        """Whether workers idle for want of small jobs, see WorkerPool.starved."""
+        return self.__pool.starved
+
+    @property
+    def recycled(self) -> int:
+        """Number of workers replaced after reaching their task count or memory limit."""
+        return self.__pool.recycled
+
+    def __dispatch(self, tasks: tuple[Union[ResizeJob, FanOutJob, StitchJob], ...], large: bool=False) -> None:
+        self.__in_flight += 1
+        self.__pool.submit((tasks,), large)
+
+    def submit(self, jobs: tuple[Union[ResizeJob, FanOutJob], ...]) -> None:
+        """Hand a chunk of jobs to one worker."""
+        for job in jobs:
+            for part in (job.jobs if isinstance(job, FanOutJob) else (job,)):
+                self.__submitted[part.output_path] = part
+        self.__dispatch(jobs, any(is_large(job, self.__limits) for job in jobs))
+
+    def wait(self, timeout: Optional[float]=None) -> List[ResizeResult]:
+        """
+        Wait for the next task to come back.
+
+        Returns:
+            List[ResizeResult]: The documents it completed, possibly none (a
+                page range of a split document, or nothing before `timeout`).
+        """
+        try:
+            results = self.__pool.get(timeout)
+        except queue.Empty:
+            return []
+        self.__in_flight -= 1
+        if isinstance(results, WorkerLost):
+            results = lost_results(results.task[0], results)
+        elif isinstance(results, BaseException):
+            raise results
+        completed = []
+        for result in results:
+            job = self.__submitted.pop(result.output_path, None)
+            if result.status == "split" and job is not None:
+                range_size = self.__pages_per_range or math.ceil(result.pages / self.__workers)
+                parts = split_job(job, result.pages, range_size)
+                split_document = _SplitDocument(result, parts)
+                for part in parts:
+                    self.__split_parts[part.output_path] = split_document
+                    self.__dispatch((part,))
+            elif result.output_path in self.__split_parts:
+                split_document = self.__split_parts.pop(result.output_path)
+                if not split_document.add_part_result(result):
+                    continue
+                if split_document.failed():
+                    completed.append(split_document.finish())
+                else:
+                    self.__stitching[split_document.result.output_path] = split_document
+                    self.__dispatch((split_document.stitch_job(),))
+            elif job is None and result.output_path in self.__stitching:
+                completed.append(self.__stitching.pop(result.output_path).finish(result))
+            else:
+                completed.append(result)
+        return completed
+
+def run_batch(
+        jobs: Iterable[Union[ResizeJob, FanOutJob]],
+        workers: Optional[int]=None,
+        chunksize: int=1,
+        pages_per_range: Optional[int]=None,
+        limits: MemoryLimits=MemoryLimits()
+    ) -> Iterator[ResizeResult]:
+    """
+    Run a batch of resize jobs, yielding each result as soon as it is ready.
+
+    Documents above their job's `split_threshold` are split into page ranges
+    which are scaled by different workers and stitched back in page order.
+
+    Args:
+        jobs (Iterable[ResizeJob | FanOutJob]): The jobs to execute, a fan-out job
+            giving one result per format.
+        workers (int, optional): Number of worker processes. Defaults to the CPU count.
+            With a single worker the jobs run in the current process, without splitting.
+        chunksize (int): Number of jobs handed to a worker at once.
+        pages_per_range (int, optional): Pages per range of a split document.
+            Defaults to spreading the document evenly over the workers.
+        limits (MemoryLimits): Worker recycling, memory watermark and large lane
+            of the pool. Not applied with a single worker.
+
+    Returns:
+        Iterator[ResizeResult]: Results in completion order.
+    """
+    workers = workers or cpu_count()
+    if workers == 1:
+        for job in jobs:
+            if isinstance(job, FanOutJob):
+                yield from resize_fanout(job)
+            else:
+                yield resize_document(replace(job, split_threshold=0))
+        return
+
+    pending_jobs = iter(jobs)
+    with BatchEngine(workers, pages_per_range, limits) as engine:
+        def fill() -> None:
+            # Large jobs wait for their lane, small ones are pulled in to keep the other workers busy
+            while engine.in_flight < workers * 2 or engine.starved:
+                tasks = tuple(islice(pending_jobs, chunksize))
+                if not tasks:
+                    return
+                engine.submit(tasks)
+
+        fill()
+        while engine.in_flight:
+            yield from engine.wait()
+            fill()
@@ -0,0 +1,131 @@
+import io
+import zlib
+import pypdf
+from typing import Optional
+from pypdf.generic import (
+    DictionaryObject,
+    EncodedStreamObject,
+    NameObject,
+    NumberObject
+)
+
+try:
+    from PIL import Image
+except ImportError:
+    # Downsampling is optional, without Pillow images are written as they are
+    Image = None
+
+# Color spaces re-encoded as they are, with the Pillow mode of their pixels
+MODES = {"/DeviceGray": "L", "/DeviceRGB": "RGB"}
+
+def image_mode(image: EncodedStreamObject) -> Optional[str]:
+    """Pillow mode of an image XObject, None for the kinds left untouched (masks, palettes, CMYK, 1-bit)."""
+    if image.get("/ImageMask") or "/Mask" in image or image.get("/BitsPerComponent") != 8:
+        return None
+    color_space = image.get("/ColorSpace")
+    color_space = color_space.get_object() if color_space is not None else None
+    if isinstance(color_space, list) and len(color_space) == 2 and color_space[0] == "/ICCBased":
+        return {1: "L", 3: "RGB"}.get(color_space[1].get_object().get("/N"))
+    return MODES.get(color_space)
+
+def effective_dpi(image: EncodedStreamObject, page_dimensions: tuple[float, float]) -> float:
+    """
+    Resolution of an image once shown on a page of `page_dimensions` points.
+
+    Scans fill their page, so the image is taken to cover the whole page. An
+    image drawn smaller has a higher real resolution: the estimate errs on
+    the side of keeping pixels. The lower of both axes is used for the same reason.
+    """
+    return min(
+        int(image["/Width"]) / (page_dimensions[0] / 72),
+        int(image["/Height"]) / (page_dimensions[1] / 72)
+    )
+
+def downsample_image(
+        image: EncodedStreamObject,
+        page_dimensions: tuple[float, float],
+        max_dpi: int,
+        jpeg_quality: int=80
+    ) -> bool:
+    """
+    Resample an image XObject in place to `max_dpi` when it is shown above it.
+
+    JPEG images are encoded again as JPEG at `jpeg_quality`, the others stay
+    lossless (Flate), so text scanned as a lossless image does not pick up
+    JPEG artifacts. The image keeps its data when the new one is not smaller.
+
+    Returns:
+        bool: Whether the image was replaced.
+    """
+    filters = image.get("/Filter")
+    filters = [filters] if isinstance(filters, str) else list(filters or [])
+    mode = image_mode(image)
+    dpi = effective_dpi(image, page_dimensions)
+    if mode is None or dpi <= max_dpi or filters not in (["/DCTDecode"], ["/FlateDecode"]):
+        return False
+    size = (int(image["/Width"]), int(image["/Height"]))
+    if filters == ["/DCTDecode"]:
+        pixels = Image.open(io.BytesIO(image._data))
+        pixels.draft(mode, (round(size[0] * max_dpi / dpi), round(size[1] * max_dpi / dpi)))
+        pixels = pixels.convert(mode)
+    else:
+        pixels = Image.frombytes(mode, size, image.get_data())
+    new_size = (max(1, round(size[0] * max_dpi / dpi)), max(1, round(size[1] * max_dpi / dpi)))
+    pixels = pixels.resize(new_size, Image.Resampling.LANCZOS)
+    if filters == ["/DCTDecode"]:
+        output = io.BytesIO()
+        pixels.save(output, "JPEG", quality=jpeg_quality, optimize=True)
+        data = output.getvalue()
+    else:
+        data = zlib.compress(pixels.tobytes())
+    if len(data) >= len(image._data):
+        return False
+    image._data = data
+    image[NameObject("/Width")] = NumberObject(new_size[0])
+    image[NameObject("/Height")] = NumberObject(new_size[1])
+    image[NameObject("/Filter")] = NameObject(filters[0])
+    if "/DecodeParms" in image:
+        del image["/DecodeParms"]
+    return True
+
+def downsample_page(
+        page: pypdf.PageObject,
+        max_dpi: int,
+        jpeg_quality: int=80,
+        page_dimensions: Optional[tuple[float, float]]=None
+    ) -> int:
+    """
+    Downsample the images of a page, and of the form XObjects it draws, above `max_dpi`.
+
+    The effective resolution is computed from the final size of the page, so
+    this runs once the page has been resized, or is given that size. Images
+    shared by several pages are resampled once: the next time they are
+    already below the ceiling.
+
+    Args:
+        page_dimensions (tuple[float, float], optional): Size in points the page
+            will have once resized. Defaults to its current media box.
+
+    Returns:
+        int: The number of images replaced.
+    """
+    if Image is None:
+        raise RuntimeError('Downsampling images needs Pillow, install it with "pip install Pillow".')
+    page_dimensions = page_dimensions or (float(page.mediabox.width), float(page.mediabox.height))
+    resampled = 0
+    pending = [page.get("/Resources")]
+    seen = set()
+    while pending:
+        resources = pending.pop()
+        resources = resources.get_object() if resources is not None else None
+        if not isinstance(resources, DictionaryObject) or id(resources) in seen:
+            continue
+        seen.add(id(resources))
+        xobjects = resources.get("/XObject")
+        for reference in (xobjects.get_object().values() if xobjects is not None else []):
+            xobject = reference.get_object()
+            if xobject.get("/Subtype") == "/Form":
+                pending.append(xobject.get("/Resources"))
+            elif xobject.get("/Subtype") == "/Image" and isinstance(xobject, EncodedStreamObject):
+                resampled += downsample_image(xobject, page_dimensions, max_dpi, jpeg_quality)
+    return resampled
@@ -1,114 +1,212 @@
-from dataclasses import dataclass
+import argparse
+import asyncio
 import os
-import pypdf
 import time
+from dataclasses import replace
 from progress.bar import Bar
-from typing import Literal, List
-from multiprocessing import Pool, cpu_count
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Union
+from api import MEMORY_LABEL, run_in_memory
+from catalog import MetadataCatalog, is_sized, plan_batch
+from discovery import OrderBy, RetrievedFilesType, scan_documents, sort_documents, stat_document, validate_documents, write_order
+from engine import (
+    BatchEngine,
+    FanOutJob,
+    MergeJob,
+    PdfInput,
+    ResizeJob,
+    ResizeResult,
+    merge_documents,
+    remove_leftovers,
+    resize_document,
+    resize_fanout,
+    run_batch,
+    with_source_pages
+)
+from images import Image
+from pool import run_pipeline
 from utils.bcolors import bcolors
-from utils.clear_terminal import clear_terminal
+from streaming import Optimize
+from transforms import FORMATS, Engine, FitMode, Format, format_dimensions
+from utils.fastcopy import LinkMode, clone_file
+from utils.source import InputMode, throttle_share
+from utils.journal import BatchJournal
+from utils.manifest import SkipManifest
+from utils.metrics import MetricsSink, format_summary, read_metrics, summarize
+from utils.profiling import ProfileReport
+from utils.reporter import create_report
+from watcher import FolderWatcher
+from workers import MemoryLimits
+from scheduling import OrderedResults, Schedule, largest_first
+from server import JobServer
+from staging import StagingCache, run_staged
+from utils.memory import MB
 
-@dataclass
-class RetrievedFilesType:
-    name: str
-    path: str
-    created_at: str
-    last_modified_at: str
+DEFAULT_INPUT_PATH = 'J:/arquivos_digitalizados/licenciatura_em_educacao_fisica/em_andamento/licenciatura_em_educacao_fisica_2022(2)/'
+DEFAULT_OUTPUT_PATH = 'J:/arquivos_digitalizados/licenciatura_em_educacao_fisica/finalizados/licenciatura_em_educacao_fisica_2022(2)/'
 
 class ResizePDF:
     def __init__(
             self, 
             input_path: str, 
             output_path: str, 
-            desired_format: Literal["A2","A3", "A4", "A5", "L13"], 
-            order_by: Literal["creation_date", "last_modification_date", "name"]="name",
+            desired_format: Union[Format, List[Format]], 
+            order_by: OrderBy="name",
             use_custom_order: bool=False,
-            custom_order_path: str='order.txt'
+            custom_order_path: str='order.txt',
+            workers: Optional[int]=None,
+            chunksize: int=1,
+            split_threshold: int=500,
+            pages_per_range: Optional[int]=None,
+            force: bool=False,
+            manifest_path: Optional[str]=None,
+            journal_path: Optional[str]=None,
+            catalog_path: Optional[str]=None,
+            tolerance: float=1.0,
+            link_mode: LinkMode="reflink",
+            engine: Engine="scale",
+            fit: FitMode="stretch",
+            window: int=0,
+            input_mode: InputMode="buffered",
+            recursive: bool=False,
+            io_workers: int=0,
+            metrics_path: Optional[str]=None,
+            profile_every: int=0,
+            profile_output: Optional[str]=None,
+            optimize: Optimize="none",
+            max_dpi: int=0,
+            jpeg_quality: int=80,
+            schedule: Schedule="largest-first",
+            memory_limits: MemoryLimits=MemoryLimits(),
+            staging_path: Optional[str]=None,
+            staging_budget_mb: int=2048,
+            staging_threads: int=4,
+            staging_batch: int=8,
+            share_latency: float=0.0
         ) -> None:
 
         self.__input_path = input_path
         self.__input_filename = os.path.basename(input_path)
         self.__output_path = f'{output_path}{self.__input_filename}'
-        self.__desired_format = desired_format
+        # Several formats are written from a single parse, each into its own output tree
+        self.__target_formats: List[Format] = [desired_format] if isinstance(desired_format, str) else list(desired_format)
+        self.__desired_format = self.__target_formats[0]
+        self.__format_key = '+'.join(self.__target_formats)
         self.__desired_doc_type = 'pdf'
         self.__order_by = order_by
 
         self.__USE_CUSTOM_ORDER = use_custom_order
         self.__CUSTOM_ORDER_PATH = custom_order_path
-        self.__MEASEURE_POINTS = 2.83464567
+        self.__workers = workers
+        self.__chunksize = chunksize
+        self.__split_threshold = split_threshold
+        self.__pages_per_range = pages_per_range
+        self.__force = force
+        self.__tolerance = tolerance
+        self.__link_mode = link_mode
+        self.__engine = engine
+        self.__fit = fit
+        self.__window = window
+        self.__input_mode = input_mode
+        self.__recursive = recursive
+        self.__io_workers = io_workers
+        self.__metrics = MetricsSink(metrics_path) if metrics_path else None
+        self.__profile_every = profile_every
+        self.__optimize = optimize
+        self.__max_dpi = max_dpi
+        self.__jpeg_quality = jpeg_quality
+        self.__schedule = schedule
+        self.__memory_limits = memory_limits
+        self.__staging_options = (staging_path, staging_budget_mb * MB, staging_threads, staging_batch) if staging_path else None
+        if share_latency:
+            # Staged or not, the input and output folders pay the same latency
+            input_folder = input_path if os.path.isdir(input_path) else os.path.dirname(input_path) or '.'
+            throttle_share(share_latency, input_folder, os.path.dirname(output_path) or '.')
+        self.__staging: Optional[StagingCache] = None
+        self.__profile_output = profile_output
+        self.__profile_report = ProfileReport()
+        self.__jobs_created = 0
 
-        self.__formats = {
-            "A2": (420, 594),
-            "A3": (297, 420),
-            "A4": (210, 297),
-            "A5": (148, 210)
-        }
+        if engine == "scale" and fit != "stretch":
+            raise ValueError('The "fit" mode needs the "xobject" engine.')
+        if max_dpi and Image is None:
+            raise ValueError('Downsampling images (max_dpi) needs Pillow, install it with "pip install Pillow".')
 
         self.__desired_dimensions = self.mm_to_point_transformation()
 
-        os.makedirs(output_path, exist_ok=True)
+        # Folders are only created by the runs that write to them, see __prepare_output
+        self.__output_folder = output_path
+        self.__manifest = SkipManifest(manifest_path or os.path.join(output_path, '.resize_manifest.json'))
+        self.__journal = BatchJournal(journal_path or os.path.join(output_path, '.resize_journal.jsonl'))
+        self.__catalog_path = catalog_path or os.path.join(output_path, '.resize_catalog.sqlite')
 
-        self.__report = []
+        self.__report: List[ResizeResult] = []
+        # Sources with a failed output since they were last submitted, see __register_result
+        self.__failed_sources: set[str] = set()
 
     def is_pdf(self, file: str) -> bool:
         filename = file or self.__input_filename
         return filename.split('.')[-1].lower() == self.__desired_doc_type
 
     def retrieve_custom_pdfs(self) -> List[RetrievedFilesType]:
-        document_list = []
-        for doc in self.read_order_from_file():
-            created_at, last_modified_at = self.get_doc_info(doc)
-            document_list.append(
-                RetrievedFilesType(
-                    name=os.path.basename(doc),
-                    path=doc,
-                    created_at=created_at,
-                    last_modified_at=last_modified_at
-                )
-            )
-        return document_list
+        return self.validate_custom_pdfs()[0]
+
+    def validate_custom_pdfs(self) -> tuple[List[RetrievedFilesType], List[tuple[str, str]]]:
+        """Check every entry of the order file at once and report the missing or invalid ones."""
+        valid, invalid = validate_documents(self.read_order_from_file())
+        if invalid:
+            print(f'{bcolors.WARNING}{len(invalid)} entries of [{self.__CUSTOM_ORDER_PATH}] are missing or invalid:')
+            for path, reason in invalid:
+                print(f'{bcolors.WARNING}  {path}: {reason}')
+        return valid, invalid
 
     def retrieve_pdfs_per_folder(self) -> List[RetrievedFilesType]:
-        document_list = os.listdir(self.__input_path)
-        pdf_list = []
-        for doc in document_list:
-            if self.is_pdf(doc):
-                created_at, last_modified_at = self.get_doc_info(f'{self.__input_path}{doc}')
-                pdf_list.append(
-                    RetrievedFilesType(
-                        name=doc,
-                        path=f'{self.__input_path}{doc}',
-                        created_at=created_at,
-                        last_modified_at=last_modified_at
-                    )
-                )
-        ordenated_pdf_list = self.ordenate_files(pdf_list)
-        self.write_order_in_txt(ordenated_pdf_list)
-        return ordenated_pdf_list
-
-    def ordenate_files(self, pdf_list: List[RetrievedFilesType]) -> List[RetrievedFilesType]:
-        if self.__order_by == "name":
-            return sorted(pdf_list, key=lambda x: x.name)
-        elif self.__order_by == "creation_date":
-            return sorted(pdf_list, key=lambda x: x.created_at)
-        elif self.__order_by == "last_modification_date":
-            return sorted(pdf_list, key=lambda x: x.last_modified_at)
-        else:
-            return pdf_list
+        pdf_list = self.ordenate_files(
+            scan_documents(self.__input_path, self.__desired_doc_type, self.__recursive)
+        )
+        self.write_order_in_txt(pdf_list)
+        return pdf_list
+
+    def ordenate_files(self, pdf_list: Iterable[RetrievedFilesType]) -> List[RetrievedFilesType]:
+        return sort_documents(pdf_list, self.__order_by)
 
     def write_order_in_txt(self, pdf_list: List[RetrievedFilesType], complete_path: bool = True) -> None:
-        with open(self.__CUSTOM_ORDER_PATH, 'w') as file:
-            for doc in pdf_list:
-                document_name = doc.path if complete_path else doc.name
-                file.write(f'{document_name}\n')
+        write_order(self.__CUSTOM_ORDER_PATH, pdf_list, complete_path)
+
+    def __prepare_output(self) -> None:
+        """Create the output folders, and the staging cache, before a run that writes files."""
+        os.makedirs(self.__output_folder, exist_ok=True)
+        if self.__fan_out:
+            for target_format in self.__target_formats:
+                os.makedirs(f'{self.__output_folder}{target_format}', exist_ok=True)
+        if self.__staging_options and self.__staging is None:
+            self.__staging = StagingCache(*self.__staging_options)
+
+    @property
+    def __fan_out(self) -> bool:
+        return len(self.__target_formats) > 1
+
+    def __output_root(self, desired_format: Optional[str]=None) -> str:
+        """Output path of the input, in the tree of `desired_format` when several formats are written."""
+        if not self.__fan_out:
+            return self.__output_path
+        return f'{self.__output_folder}{desired_format or self.__desired_format}/{self.__input_filename}'
+
+    def output_for(self, doc: RetrievedFilesType, desired_format: Optional[str]=None) -> str:
+        """Output path of a document, mirroring its sub folder when the input was scanned recursively."""
+        relative_path = os.path.relpath(doc.path, self.__input_path) if self.__recursive else doc.name
+        if relative_path.startswith('..'):
+            relative_path = doc.name
+        output_path = self.__output_root(desired_format) + relative_path
+        if self.__recursive:
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        return output_path
 
     def read_order_from_file(self) -> List[str]:
         order_list = []
         try:
             with open(self.__CUSTOM_ORDER_PATH, 'r') as file:
-                for count, line in enumerate(file):
-                    print(f'{bcolors.OKCYAN}{count} - {line}')
-                    order_list.append(line.strip())
+                order_list = [line.strip() for line in file if line.strip()]
+            print(f'{bcolors.OKCYAN}{len(order_list)} entries read from [{self.__CUSTOM_ORDER_PATH}].')
         except FileNotFoundError:
             print(f'{bcolors.WARNING}File [{self.__CUSTOM_ORDER_PATH}] not found. Please check for misspelled paths.')
         except Exception as err:
@@ -120,91 +218,374 @@ class ResizePDF:
         print("{:<30} {:<50} {:<20} {:<20}".format("Name", "Path", "Created At", "Last Modified At"))
         print("-" * 120)
         for doc in pdf_list:
-            print("{:<30} {:<50} {:<20} {:<20}".format(doc.name, doc.path, doc.created_at, doc.last_modified_at))
+            print("{:<30} {:<50} {:<20} {:<20}".format(doc.name, doc.path, time.ctime(doc.created_at), time.ctime(doc.last_modified_at)))
 
-    def get_doc_info(self, path: str) -> tuple[str, str]:
-        creation_time = os.path.getctime(path)
-        lastmodified_time = os.path.getmtime(path)
-        return time.ctime(creation_time), time.ctime(lastmodified_time)
+    def get_doc_info(self, path: str) -> tuple[float, float]:
+        doc = stat_document(path)
+        return doc.created_at, doc.last_modified_at
 
-    def mm_to_point_transformation(self) -> tuple[float, float]:
-        final_width = round(self.__formats[self.__desired_format][0] * self.__MEASEURE_POINTS, 3)
-        final_height = round(self.__formats[self.__desired_format][1] * self.__MEASEURE_POINTS, 3)
-        return final_width, final_height
+    def mm_to_point_transformation(self, desired_format: Optional[str]=None) -> tuple[float, float]:
+        return format_dimensions(desired_format or self.__desired_format)
 
     def get_scale_factor(self, original_dimension: tuple[float, float]) -> tuple[float, float]:
         width_scale_factor = self.__desired_dimensions[0] / original_dimension[0]
         height_scale_factor = self.__desired_dimensions[1] / original_dimension[1]
         return width_scale_factor, height_scale_factor
 
-    def __handle_resize(self, pdf_file_path: str, output_path: str):
-        try:
-            print(f'{bcolors.OKBLUE} Processing [{self.__input_filename}]...')
-            with open(pdf_file_path, 'rb') as file:
-                reader = pypdf.PdfReader(file)
-                writer = pypdf.PdfWriter()
-                for page_number in range(len(reader.pages)):
-                    page = reader.pages[page_number]
-                    original_height = float(page.mediabox.height)
-                    original_width = float(page.mediabox.width)
-                    original_dimension = (original_width, original_height)
-                    if original_dimension == self.__desired_dimensions:
-                        writer.add_page(page)
-                        continue
-                    scale_factor = self.get_scale_factor(original_dimension)
-                    page.scale(scale_factor[0], scale_factor[1])
-                    page.mediabox.lower_left = (0, 0)
-                    page.mediabox.upper_right = self.__desired_dimensions
-                    writer.add_page(page)
-                with open(output_path, 'wb') as output_file:
-                    writer.write(output_file)
-            print(f'{bcolors.OKGREEN}The PDF file ({self.__input_filename}) has been resized with success!')
-        except Exception as error:
-            print(f'{bcolors.FAIL}An error occurred: ', error)
+    def create_job(self, pdf_file_path: str, output_path: str, desired_format: Optional[str]=None) -> ResizeJob:
+        self.__jobs_created += 1
+        # A source submitted again, in a long watch session, is judged on its new outputs only
+        self.__failed_sources.discard(pdf_file_path)
+        return ResizeJob(
+            source_path=pdf_file_path,
+            output_path=output_path,
+            dimensions=self.mm_to_point_transformation(desired_format) if desired_format else self.__desired_dimensions,
+            split_threshold=self.__split_threshold,
+            hash_source=True,
+            tolerance=self.__tolerance,
+            link_mode=self.__link_mode,
+            engine=self.__engine,
+            fit=self.__fit,
+            window=self.__window,
+            input_mode=self.__input_mode,
+            page_metrics=self.__metrics is not None,
+            profile=bool(self.__profile_every) and (self.__jobs_created - 1) % self.__profile_every == 0,
+            optimize=self.__optimize,
+            max_dpi=self.__max_dpi,
+            jpeg_quality=self.__jpeg_quality
+        )
+
+    def outputs_for(self, doc: RetrievedFilesType) -> List[str]:
+        """Output paths of a document, one per target format."""
+        return [self.output_for(doc, target_format) for target_format in self.__target_formats]
+
+    def __is_current(self, source_path: str, output_paths: List[str]) -> bool:
+        """Whether a source is converted to the target formats and every one of its outputs is still there."""
+        return all(self.__manifest.is_current(source_path, output_path, self.__format_key) for output_path in output_paths)
+
+    def skip_current_documents(self, pdf_list: List[RetrievedFilesType]) -> List[RetrievedFilesType]:
+        if self.__force:
+            return pdf_list
+        pending_list = [doc for doc in pdf_list if not self.__is_current(doc.path, self.outputs_for(doc))]
+        skipped = len(pdf_list) - len(pending_list)
+        if skipped:
+            print(f'{bcolors.OKCYAN}Skipping {skipped} files already converted to {self.__format_key} (use --force to redo them).')
+            self.__manifest.save()
+        return pending_list
+
+    def __register_result(self, result: ResizeResult) -> None:
+        self.__report.append(result)
+        if self.__metrics:
+            self.__metrics.record(result)
+        if result.profile:
+            self.__profile_report.add(result.profile)
+        # A source written to several formats is current only once all of them are done
+        if result.status == "done" and result.source_path not in self.__failed_sources:
+            stat = (result.bytes_in, result.source_mtime_ns) if result.source_mtime_ns is not None else (None, None)
+            self.__manifest.record(result.source_path, self.__format_key, result.source_sha256, *stat)
+            self.__journal.record(result.source_path, result.output_path, self.__format_key, result.source_sha256, *stat)
+        else:
+            self.__failed_sources.add(result.source_path)
+            self.__manifest.forget(result.source_path)
+            if self.__fan_out:
+                self.__journal.forget(result.source_path)
+        if len(self.__report) % 100 == 0:
+            self.__manifest.save()
+
+    def __finish_run(self) -> None:
+        self.__manifest.save()
+        self.__journal.finish()
+        if self.__profile_report.documents:
+            print(self.__profile_report.format())
+            if self.__profile_output:
+                self.__profile_report.dump(self.__profile_output)
+                print(f'{bcolors.OKGREEN}Merged profile saved to [{self.__profile_output}].')
+
+    def __handle_resize(self, pdf_file_path: str, output_path: str) -> ResizeResult:
+        filename = os.path.basename(pdf_file_path)
+        print(f'{bcolors.OKBLUE} Processing [{filename}]...')
+        job = self.create_job(pdf_file_path, output_path)
+        if self.__staging is not None:
+            # Staged documents run through the pool, which splits the large ones itself
+            [result] = run_staged([job], self.__run_jobs, self.__staging)
+        else:
+            result = resize_document(job)
+        if result.status == "split":
+            print(f'{bcolors.OKCYAN} [{filename}] has {result.pages} pages, splitting it into page ranges...')
+            result = next(run_batch([job], self.__workers, pages_per_range=self.__pages_per_range, limits=self.__memory_limits))
+        self.__register_result(result)
+        if result.status == "done" and result.passthrough:
+            print(f'{bcolors.OKGREEN}The PDF file ({filename}) already has the desired size, {result.passthrough} done.')
+        elif result.status == "done":
+            print(f'{bcolors.OKGREEN}The PDF file ({filename}) has been resized with success!')
+        else:
+            print(f'{bcolors.FAIL}An error occurred: ', result.error)
+        return result
+
+    def resize_buffer(self, source: PdfInput, output: Optional[BinaryIO]=None) -> Optional[bytes]:
+        """
+        Resize a document held in memory with the options of this instance,
+        without touching the file system (see api.resize_pdf). With several
+        formats the first one is used.
+
+        Args:
+            source (PdfInput): The document as bytes, bytearray or memoryview, or a
+                readable binary file object.
+            output (BinaryIO, optional): Receives the resized document. When None the
+                document is returned.
+
+        Returns:
+            bytes, optional: The resized document, None when it was written to `output`.
+        """
+        job = replace(self.create_job(MEMORY_LABEL, MEMORY_LABEL), hash_source=False, profile=False)
+        return run_in_memory(job, source, output)
+
+    def create_task(self, doc: RetrievedFilesType) -> Union[ResizeJob, FanOutJob]:
+        """The job of a document, or its fan-out job when several formats are written."""
+        if not self.__fan_out:
+            return self.create_job(doc.path, self.output_for(doc))
+        return FanOutJob(tuple(
+            self.create_job(doc.path, self.output_for(doc, target_format), target_format)
+            for target_format in self.__target_formats
+        ))
+
+    def __handle_fanout(self, pdf_file_path: str, output_paths: List[str]) -> None:
+        print(f'{bcolors.OKBLUE} Processing [{os.path.basename(pdf_file_path)}] to {self.__format_key}...')
+        job = FanOutJob(tuple(
+            self.create_job(pdf_file_path, output_path, target_format)
+            for target_format, output_path in zip(self.__target_formats, output_paths)
+        ))
+        for result in resize_fanout(job):
+            self.__register_result(result)
+            if result.status == "done":
+                print(f'{bcolors.OKGREEN}The PDF file ({result.output_path}) has been written with success!')
+            else:
+                print(f'{bcolors.FAIL}An error occurred in ({result.output_path}): ', result.error)
+
+    def __run_jobs(self, jobs: Iterable[Union[ResizeJob, FanOutJob]]) -> Iterator[ResizeResult]:
+        if self.__io_workers and not self.__fan_out:
+            return run_pipeline(jobs, self.__workers, self.__io_workers)
+        return run_batch(jobs, self.__workers, self.__chunksize, self.__pages_per_range, self.__memory_limits)
 
     def resize_pipeline(self, pdf_list: List[RetrievedFilesType]) -> None:
         print(f'{bcolors.OKBLUE}Converting {len(pdf_list)} files...')
-        progress_bar = Bar(f'{bcolors.OKBLUE}Processing {self.__input_filename}...', max=len(pdf_list))
-        
-        def process_document(doc):
-            self.__input_filename = doc.name
-            self.__handle_resize(doc.path, self.__output_path + self.__input_filename)
-        
-        with Pool(cpu_count()) as pool:
-            for _ in pool.imap_unordered(process_document, pdf_list):
-                progress_bar.next()
-        
+        progress_bar = Bar(f'{bcolors.OKBLUE}Processing...', max=len(pdf_list) * len(self.__target_formats))
+        jobs = [self.create_task(doc) for doc in pdf_list]
+        if os.path.isfile(self.__catalog_path):
+            catalog = MetadataCatalog(self.__catalog_path)
+            for index, doc in enumerate(pdf_list):
+                row = catalog.get(doc)
+                if row is not None and not row["error"]:
+                    jobs[index] = with_source_pages(jobs[index], row["pages"])
+                    if not self.__fan_out and jobs[index].keeps_sized_source and is_sized(row, self.__desired_dimensions, self.__tolerance):
+                        jobs[index] = replace(jobs[index], known_sized_pages=row["pages"])
+            catalog.close()
+        ordered_results = OrderedResults(jobs)
+        if self.__schedule == "largest-first":
+            jobs = largest_first(jobs)
+        if self.__staging is not None:
+            results = run_staged(jobs, self.__run_jobs, self.__staging)
+        else:
+            results = self.__run_jobs(jobs)
+        for result in results:
+            self.__register_result(result)
+            for ready in ordered_results.add(result):
+                if ready.status == "failed":
+                    print(f'\n{bcolors.FAIL}An error occurred in ({ready.name}): ', ready.error)
+            progress_bar.next()
         progress_bar.finish()
+        self.__finish_run()
 
-    def resize_a_single_file(self) -> None:
-        if self.is_pdf(self.__input_filename):
-            self.__handle_resize(self.__input_path, self.__output_path)
-        else:
+    def resize_a_single_file(self, doc: Optional[RetrievedFilesType]=None) -> None:
+        if doc is not None and self.__fan_out:
+            self.__handle_fanout(doc.path, [self.output_for(doc, target_format) for target_format in self.__target_formats])
+        elif doc is not None:
+            self.__handle_resize(doc.path, self.output_for(doc))
+        elif not self.is_pdf(self.__input_filename):
             print(f'{bcolors.FAIL}The file ({self.__input_filename}) is not a PDF or is not supported.')
+        elif not self.__force and self.__is_current(self.__input_path, [self.__output_root(target_format) for target_format in self.__target_formats]):
+            print(f'{bcolors.OKCYAN}The PDF file ({self.__input_filename}) is already converted, skipping.')
+        elif self.__fan_out:
+            self.__handle_fanout(self.__input_path, [self.__output_root(target_format) for target_format in self.__target_formats])
+        else:
+            self.__handle_resize(self.__input_path, self.__output_path)
+        self.__finish_run()
 
     def resize_using_custom_order(self) -> None:
-        custom_list = self.retrieve_custom_pdfs()
         print(f'{bcolors.HEADER}Checking for files veracity...')
-        print('\n' * os.get_terminal_size().lines)
-        for item in custom_list:
-            self.__input_filename = item.name
-            self.__handle_resize(item.path, self.__output_path + self.__input_filename)
+        self.__prepare_output()
+        self.__journal.begin("custom-order")
+        custom_list = self.retrieve_custom_pdfs()
+        pdf_list = self.skip_current_documents(custom_list)
+        if pdf_list:
+            self.resize_pipeline(pdf_list)
+        else:
+            print(f"{bcolors.WARNING}No PDF files to convert in [{self.__CUSTOM_ORDER_PATH}].")
+            self.__journal.finish()
+        # The outputs skipped as current take their place in the order too
+        self.__stamp_order(custom_list)
+
+    def merge_custom_order(self, merged_name: str='merged.pdf') -> None:
+        """
+        Resize every document listed in the order file into a single output, in that order.
+
+        The documents are read once each and streamed into the output (see
+        engine.merge_documents); the manifest is not used, every listed file is merged.
+        """
+        custom_list, invalid = self.validate_custom_pdfs()
+        if invalid:
+            print(f'{bcolors.FAIL}Fix or remove the invalid entries first, the merged PDF would miss them.')
+            return
+        if not custom_list:
+            print(f"{bcolors.WARNING}No PDF files to merge in [{self.__CUSTOM_ORDER_PATH}].")
+            return
+        self.__prepare_output()
+        output_path = self.__output_path + merged_name
+        print(f'{bcolors.OKBLUE}Merging {len(custom_list)} files into [{output_path}]...')
+        jobs = tuple(replace(self.create_job(doc.path, output_path), hash_source=False) for doc in custom_list)
+        result = merge_documents(MergeJob(jobs, output_path))
+        self.__report.append(result)
+        if self.__metrics:
+            self.__metrics.record(result)
+        if result.status == "done":
+            print(f'{bcolors.OKGREEN}{len(custom_list)} files merged into ({merged_name}), {result.pages} pages.')
+        else:
+            print(f'{bcolors.FAIL}An error occurred while merging: ', result.error)
+        self.__finish_run()
+
+    def __stamp_order(self, pdf_list: List[RetrievedFilesType]) -> None:
+        """
+        Give the outputs increasing modification times in the order of `pdf_list`.
+
+        The workers finish in any order, while the outputs are usually sorted
+        by last modification date downstream, as they were when converted one
+        by one. Every listed output is stamped, the ones skipped as current
+        included. A hardlinked output shares the source's inode, stamping it
+        would touch the source: it is replaced by its own copy first.
+        """
+        base = time.time_ns()
+        for index, doc in enumerate(pdf_list):
+            for output_path in self.outputs_for(doc):
+                try:
+                    if os.stat(output_path).st_nlink > 1:
+                        clone_file(output_path, output_path, "reflink")
+                    os.utime(output_path, ns=(base + index * 1000, base + index * 1000))
+                except FileNotFoundError:
+                    pass
 
     def resize(self) -> None:
+        self.__prepare_output()
+        self.__journal.begin("resize")
         if os.path.isfile(self.__input_path):
             self.resize_a_single_file()
         elif os.path.isdir(self.__input_path):
-            pdf_list = self.retrieve_pdfs_per_folder()
+            pdf_list = self.skip_current_documents(self.retrieve_pdfs_per_folder())
             if len(pdf_list) == 1:
                 self.resize_a_single_file(pdf_list[0])
             elif len(pdf_list) > 1:
                 self.resize_pipeline(pdf_list)
             else:
-                print(f"{bcolors.WARNING}No PDF files found in the directory.")
+                print(f"{bcolors.WARNING}No PDF files to convert in the directory.")
+                self.__journal.finish()
         else:
             print(f"{bcolors.WARNING}Invalid input path.")
+            self.__journal.finish()
+
+    def resume(self) -> None:
+        """
+        Continue the batch interrupted in this output folder.
+
+        The documents its journal lists as written are taken back into the
+        manifest and skipped, the leftovers of the documents that were being
+        written are removed, and the same command runs again on the rest.
+        """
+        command, entries = self.__journal.read()
+        if command is None:
+            print(f'{bcolors.WARNING}No interrupted batch to resume in [{self.__output_folder}].')
+            return
+        self.__prepare_output()
+        # A source written to several formats has one entry per format, all of them are needed
+        written: dict[str, int] = {}
+        for entry in entries:
+            if os.path.exists(entry["output"]):
+                written[entry["source"]] = written.get(entry["source"], 0) + 1
+                if written[entry["source"]] == len(entry["format"].split('+')):
+                    self.__manifest.restore(entry)
+        self.__manifest.save()
+        removed = remove_leftovers(self.__output_folder, self.__recursive)
+        print(f'{bcolors.HEADER}Resuming the interrupted {command}: {len(entries)} files already converted, {removed} leftovers removed.')
+        self.__force = False
+        if command == "custom-order":
+            self.resize_using_custom_order()
+        else:
+            self.resize()
+
+    def watch(self, poll_interval: float=1.0, stable_seconds: float=3.0) -> None:
+        """
+        Convert the PDFs of the input folder as they arrive, until interrupted with Ctrl+C.
+
+        Files are queued to a pool of workers that stays up for the whole session
+        as soon as their size has been stable for `stable_seconds`.
+        """
+        if not os.path.isdir(self.__input_path):
+            print(f"{bcolors.WARNING}Invalid input path, watch mode needs a folder.")
+            return
+        self.__prepare_output()
+        watcher = FolderWatcher(self.__input_path, self.__desired_doc_type, self.__recursive, stable_seconds)
+        print(f'{bcolors.HEADER}Watching [{self.__input_path}] for new PDFs, press Ctrl+C to stop...')
+        try:
+            with BatchEngine(self.__workers, self.__pages_per_range, self.__memory_limits) as engine:
+                while True:
+                    for doc in self.skip_current_documents(watcher.poll()):
+                        print(f'{bcolors.OKBLUE} Queued [{doc.name}]...')
+                        engine.submit((self.create_task(doc),))
+                    if not engine.in_flight:
+                        time.sleep(poll_interval)
+                        continue
+                    results = engine.wait(timeout=poll_interval)
+                    for result in results:
+                        self.__register_result(result)
+                        if result.status == "done":
+                            print(f'{bcolors.OKGREEN}The PDF file ({result.name}) has been resized with success!')
+                        else:
+                            print(f'{bcolors.FAIL}An error occurred in ({result.name}): ', result.error)
+                    if results:
+                        self.__manifest.save()
+        except KeyboardInterrupt:
+            print(f'{bcolors.WARNING}Stopped watching [{self.__input_path}].')
+        finally:
+            self.__finish_run()
+
+    def serve(
+            self,
+            host: str='127.0.0.1',
+            port: int=8765,
+            socket_path: Optional[str]=None,
+            max_in_flight: Optional[int]=None,
+            client_queue: int=16
+        ) -> None:
+        """
+        Accept resize jobs over a local socket until interrupted with Ctrl+C (see server.JobServer).
+
+        Jobs use the options of this instance; a job may ask for another format.
+        """
+        self.__prepare_output()
+        server = JobServer(
+            self.create_job,
+            lambda path: self.output_for(stat_document(path)),
+            self.__output_folder,
+            self.__workers,
+            max_in_flight,
+            client_queue
+        )
+        print(f'{bcolors.HEADER}Serving resize jobs on [{socket_path or f"{host}:{port}"}], press Ctrl+C to stop...')
+        try:
+            asyncio.run(server.serve(host, port, socket_path))
+        except KeyboardInterrupt:
+            print(f'{bcolors.WARNING}Server stopped.')
 
     def generate_report(self):
+        self.__prepare_output()
         start_time = time.time()
         pdf_list = self.retrieve_pdfs_per_folder()
         num_pdfs = len(pdf_list)
@@ -212,26 +593,190 @@ class ResizePDF:
         total_time = 0
         for doc in pdf_list:
             start_file_time = time.time()
-            self.__input_filename = doc.name
-            self.__handle_resize(doc.path, self.__output_path + self.__input_filename)
+            self.__handle_resize(doc.path, self.output_for(doc))
             end_file_time = time.time()
             file_time = end_file_time - start_file_time
             total_time += file_time
-            print(f"Time taken to process {self.__input_filename}: {file_time:.2f} seconds")
+            print(f"Time taken to process {doc.name}: {file_time:.2f} seconds")
         end_time = time.time()
         total_execution_time = end_time - start_time
         print(f"Total time taken to process all PDF files: {total_execution_time:.2f} seconds")
+        self.__finish_run()
 
-resizer = ResizePDF(
-    'J:/arquivos_digitalizados/licenciatura_em_educacao_fisica/em_andamento/licenciatura_em_educacao_fisica_2022(2)/',
-    'J:/arquivos_digitalizados/licenciatura_em_educacao_fisica/finalizados/licenciatura_em_educacao_fisica_2022(2)/',
-    "A4",
-    order_by="last_modification_date",
-    use_custom_order=True
-)
+    def plan(self, report_path: Optional[str]=None) -> None:
+        """
+        Tell what converting the input folder would do, from the metadata catalog.
+
+        The catalog is brought up to date first: only the new or changed files
+        are probed, in parallel. Batches then use it to clone the documents
+        already in the format without parsing them and to schedule by page count.
+        """
+        if os.path.isfile(self.__input_path):
+            pdf_list = [stat_document(self.__input_path)]
+        elif os.path.isdir(self.__input_path):
+            pdf_list = list(scan_documents(self.__input_path, self.__desired_doc_type, self.__recursive))
+        else:
+            print(f"{bcolors.WARNING}Invalid input path.")
+            return
+        self.__prepare_output()
+        catalog = MetadataCatalog(self.__catalog_path)
+        start = time.perf_counter()
+        probed = catalog.update(pdf_list, self.__workers)
+        print(f'{bcolors.OKCYAN}Catalog [{self.__catalog_path}]: {probed} of {len(pdf_list)} files probed in {time.perf_counter() - start:.2f} s.')
+        summary = plan_batch([catalog.get(doc) for doc in pdf_list], self.__desired_dimensions, self.__tolerance)
+        catalog.close()
+        lines = [
+            f'Plan for {summary["documents"]} documents, {summary["pages"]} pages, to {self.__desired_format}:',
+            f'  Already {self.__desired_format}: {summary["sized_documents"]} documents copied as they are, {summary["sized_pages"]} pages',
+            f'  To scale: {summary["documents_to_scale"]} documents, {summary["pages_to_scale"]} pages',
+            f'  Unreadable: {summary["unreadable"]} documents'
+        ]
+        if summary["sizes_to_scale"]:
+            lines.append('  Page sizes to scale (points):')
+            lines += [f'    {size:<16} {count:>8} pages' for size, count in list(summary["sizes_to_scale"].items())[:10]]
+        content = '\n'.join(lines)
+        print(f'{bcolors.OKBLUE}{content}{bcolors.ENDC}')
+        if report_path:
+            create_report(content, report_path)
+
+    def summarize_metrics(self, report_path: Optional[str]=None) -> None:
+        """Print the p50/p95/p99 of every stage recorded in the metrics file, optionally saving them."""
+        if self.__metrics is None or not os.path.isfile(self.__metrics.path):
+            print(f'{bcolors.WARNING}No metrics file found, run a conversion with --metrics first.')
+            return
+        summary = format_summary(summarize(read_metrics(self.__metrics.path)))
+        print(summary)
+        if report_path:
+            create_report(summary, report_path)
+
+def parse_arguments(argv: Optional[List[str]]=None) -> argparse.Namespace:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--input', default=DEFAULT_INPUT_PATH, help='PDF file or folder to convert')
+    common.add_argument('--output', default=DEFAULT_OUTPUT_PATH, help='folder that receives the converted files')
+    common.add_argument('--format', default=['A4'], nargs='+', choices=list(FORMATS), help='target paper formats, with several each one is written from a single parse into its own sub folder of the output')
+    common.add_argument('--order-by', default='last_modification_date', choices=["creation_date", "last_modification_date", "name"])
+    common.add_argument('--order-file', default='order.txt', help='custom order file')
+    common.add_argument('--workers', type=int, help='worker processes (defaults to the CPU count)')
+    common.add_argument('--chunksize', type=int, default=1, help='jobs handed to a worker at once')
+    common.add_argument('--split-threshold', type=int, default=500, help='page count above which a document is split into page ranges')
+    common.add_argument('--tolerance', type=float, default=1.0, help='points a page may differ from the format and still count as matching')
+    common.add_argument('--link-mode', default='reflink', choices=["copy", "reflink", "hardlink"], help='how documents already in the format are copied')
+    common.add_argument('--engine', default='scale', choices=["scale", "xobject"], help='rewrite content streams (scale) or wrap pages as form XObjects (xobject)')
+    common.add_argument('--fit', default='stretch', choices=["stretch", "fit"], help='stretch to the format or keep the aspect ratio and center (xobject engine only)')
+    common.add_argument('--window', type=int, default=0, help='stream pages to the output this many at a time to bound worker memory (0 keeps the whole document in memory)')
+    common.add_argument('--input-mode', default='buffered', choices=["buffered", "mmap", "memory"], help='read sources through a file object, a read-only memory map or one bulk read into memory')
+    common.add_argument('--optimize', default='none', choices=["none", "compress", "dedup", "objstm"], help='shrink the outputs: compress streams, also write identical streams once, also pack objects in object streams')
+    common.add_argument('--max-dpi', type=int, default=0, help='downsample the images shown above this resolution once the page is resized, needs Pillow (0 keeps them as they are)')
+    common.add_argument('--jpeg-quality', type=int, default=80, help='quality of the JPEG images downsampled by --max-dpi')
+    common.add_argument('--schedule', default='largest-first', choices=["order", "largest-first"], help='start the documents in list order or the largest first, estimated from their size and page count (errors are reported in list order either way)')
+    common.add_argument('--max-jobs-per-worker', type=int, default=100, help='replace a worker by a fresh process after this many tasks (0 never)')
+    common.add_argument('--max-worker-mb', type=int, default=1024, help='replace a worker once its task is done when its resident memory passed this many MB (0 never)')
+    common.add_argument('--memory-watermark-mb', type=int, default=0, help='start no task while the workers and the parent together hold more than this many MB (0 for 75%% of the physical memory)')
+    common.add_argument('--large-mb', type=int, default=100, help='sources above this many MB run in the large lane (0 disables the size threshold)')
+    common.add_argument('--large-pages', type=int, default=1000, help='sources above this many pages run in the large lane (0 disables the page threshold)')
+    common.add_argument('--large-workers', type=int, default=0, help='large sources converted at once (0 for a quarter of the workers)')
+    common.add_argument('--stage-dir', help='copy the sources to this local folder ahead of the workers and write the outputs back to the share in the background')
+    common.add_argument('--stage-budget-mb', type=int, default=2048, help='local disk the staged sources may take, the least recently used are evicted')
+    common.add_argument('--stage-threads', type=int, default=4, help='sources copied from the share at once')
+    common.add_argument('--stage-batch', type=int, default=8, help='outputs copied back to the share at most in one batch')
+    common.add_argument('--share-latency', type=float, default=0.0, help='seconds every read from the input and output folders and every file written to them waits, to test staging against a local folder')
+    common.add_argument('--io-workers', type=int, default=0, help='reader and writer processes of the staged pipeline (0 lets each worker do its own I/O)')
+    common.add_argument('--recursive', action='store_true', help='also convert the PDFs of sub folders, mirroring them in the output')
+    common.add_argument('--metrics', help='append per-document and per-page timings to this JSONL file')
+    common.add_argument('--profile-every', type=int, default=0, metavar='N', help='profile one document out of N with cProfile and tracemalloc (0 disables profiling)')
+    common.add_argument('--profile-output', help='save the merged cProfile stats of the sampled documents to this file')
+    common.add_argument('--force', action='store_true', help='convert every file, even the ones the manifest marks as current')
+
+    parser = argparse.ArgumentParser(description='Resize scanned PDF documents to a standard paper format.')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('retrieve', parents=[common], help='list the PDFs of the input folder into the order file')
+    commands.add_parser('resize', parents=[common], help='convert the input file or folder')
+    commands.add_parser('custom-order', parents=[common], help='convert the files listed in the order file')
+    merge = commands.add_parser('merge', parents=[common], help='convert the files listed in the order file into a single PDF, in that order')
+    merge.add_argument('--merged-name', default='merged.pdf', help='file name of the merged PDF, in the output folder')
+    commands.add_parser('resume', parents=[common], help='continue the resize or custom-order batch interrupted in the output folder')
+    commands.add_parser('report', parents=[common], help='convert the input folder serially, timing every file')
+    watch = commands.add_parser('watch', parents=[common], help='convert the PDFs of the input folder as they arrive')
+    watch.add_argument('--poll-interval', type=float, default=1.0, help='seconds between two checks of the folder')
+    watch.add_argument('--stable-seconds', type=float, default=3.0, help='seconds a file size must stay unchanged before it is converted')
+    serve = commands.add_parser('serve', parents=[common], help='accept resize jobs as JSON lines over a local socket')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--socket', help='listen on this Unix socket instead of TCP')
+    serve.add_argument('--max-in-flight', type=int, help='jobs handed to the workers at once, all clients together')
+    serve.add_argument('--client-queue', type=int, default=16, help='jobs read ahead from a single client')
+    plan_command = commands.add_parser('plan', parents=[common], help='index the input folder and tell how many pages are already in the format and how many to scale')
+    plan_command.add_argument('--report', help='also write the plan to this text file')
+    summary = commands.add_parser('summary', parents=[common], help='print the p50/p95/p99 of each stage recorded with --metrics')
+    summary.add_argument('--report', help='also write the summary to this text file')
+    parser.set_defaults(command='retrieve', **vars(common.parse_args([])))
+    arguments = parser.parse_args(argv)
+    if arguments.fit == 'fit' and arguments.engine == 'scale':
+        parser.error('--fit fit needs --engine xobject')
+    return arguments
+
+def main(argv: Optional[List[str]]=None) -> None:
+    arguments = parse_arguments(argv)
+    resizer = ResizePDF(
+        arguments.input,
+        arguments.output,
+        arguments.format,
+        order_by=arguments.order_by,
+        use_custom_order=True,
+        custom_order_path=arguments.order_file,
+        workers=arguments.workers,
+        chunksize=arguments.chunksize,
+        split_threshold=arguments.split_threshold,
+        force=arguments.force,
+        tolerance=arguments.tolerance,
+        link_mode=arguments.link_mode,
+        engine=arguments.engine,
+        fit=arguments.fit,
+        window=arguments.window,
+        input_mode=arguments.input_mode,
+        recursive=arguments.recursive,
+        io_workers=arguments.io_workers,
+        metrics_path=arguments.metrics,
+        profile_every=arguments.profile_every,
+        profile_output=arguments.profile_output,
+        optimize=arguments.optimize,
+        max_dpi=arguments.max_dpi,
+        jpeg_quality=arguments.jpeg_quality,
+        schedule=arguments.schedule,
+        memory_limits=MemoryLimits(
+            jobs_per_worker=arguments.max_jobs_per_worker,
+            worker_mb=arguments.max_worker_mb,
+            watermark_mb=arguments.memory_watermark_mb,
+            large_mb=arguments.large_mb,
+            large_pages=arguments.large_pages,
+            large_workers=arguments.large_workers
+        ),
+        staging_path=arguments.stage_dir,
+        staging_budget_mb=arguments.stage_budget_mb,
+        staging_threads=arguments.stage_threads,
+        staging_batch=arguments.stage_batch,
+        share_latency=arguments.share_latency
+    )
+    if arguments.command == 'resize':
+        resizer.resize()
+    elif arguments.command == 'custom-order':
+        resizer.resize_using_custom_order()
+    elif arguments.command == 'merge':
+        resizer.merge_custom_order(arguments.merged_name)
+    elif arguments.command == 'resume':
+        resizer.resume()
+    elif arguments.command == 'report':
+        resizer.generate_report()
+    elif arguments.command == 'watch':
+        resizer.watch(arguments.poll_interval, arguments.stable_seconds)
+    elif arguments.command == 'plan':
+        resizer.plan(arguments.report)
+    elif arguments.command == 'summary':
+        resizer.summarize_metrics(arguments.report)
+    elif arguments.command == 'serve':
+        resizer.serve(arguments.host, arguments.port, arguments.socket, arguments.max_in_flight, arguments.client_queue)
+    else:
+        resizer.retrieve_pdfs_per_folder()
 
-# Uncomment the function you want to execute
-resizer.retrieve_pdfs_per_folder()
-# resizer.resize()
-# resizer.resize_using_custom_order()
-# resizer.generate_report()
+if __name__ == '__main__':
+    main()
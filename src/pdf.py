@@ -4,8 +4,9 @@ import pypdf
 import time
 
 from progress.bar import Bar
-from typing import Literal, List
+from typing import Literal, List, Optional
 
+from engine import ResizeJob, run_batch
 from utils.bcolors import bcolors
 from utils.clear_terminal import clear_terminal
 
@@ -25,7 +26,9 @@ class ResizePDF:
             desired_format: Literal["A2","A3", "A4", "A5", "L13"], 
             order_by: Literal["creation_date", "last_modification_date", "name"]="name",
             use_custom_order: bool=False,
-            custom_order_path: str='order.txt'
+            custom_order_path: str='order.txt',
+            workers: Optional[int]=None,
+            chunksize: int=1
         ) -> None:
 
         self.__input_path = input_path
@@ -38,6 +41,8 @@ class ResizePDF:
         self.__USE_CUSTOM_ORDER = use_custom_order
         self.__CUSTOM_ORDER_PATH = custom_order_path
         self.__MEASEURE_POINTS = 2.83464567
+        self.__workers = workers
+        self.__chunksize = chunksize
 
         self.__formats = {
             "A2": (420, 594),
@@ -349,7 +354,7 @@ class ResizePDF:
 
 
     def resize_pipeline(self, pdf_list: List[RetrievedFilesType]) -> None:
-        """Resize multiple PDF files in a batch.
+        """Resize multiple PDF files in a batch, spread over a process pool.
 
         Args:
             pdf_list (list): List of PDF file paths.
@@ -358,20 +363,25 @@ class ResizePDF:
         print(f'{bcolors.OKBLUE}Converting {len(pdf_list)} files...')
 
         progress_bar = Bar(
-            f'{bcolors.OKBLUE}Processing {self.__input_filename}...', max=len(pdf_list)
+            f'{bcolors.OKBLUE}Processing...', max=len(pdf_list)
         )
 
-        for doc in pdf_list:
+        jobs = [
+            ResizeJob(
+                source_path=doc["path"],
+                output_path=self.__output_path + doc["name"],
+                dimensions=self.__desired_dimensions
+            )
+            for doc in pdf_list
+        ]
 
-            progress_bar.next()
+        for result in run_batch(jobs, self.__workers, self.__chunksize):
 
-            print(doc)
+            if result.status == "failed":
 
-            self.__input_filename = doc["name"]
+                print(f'\n{bcolors.FAIL}An error occurred in ({result.name}): ', result.error)
 
-            self.__handle_resize(
-                doc["path"], self.__output_path + self.__input_filename
-            )
+            progress_bar.next()
 
         progress_bar.finish()
 
@@ -498,18 +508,20 @@ class ResizePDF:
         print(f"Total time taken to process all PDF files: {total_execution_time:.2f} seconds")
 
 
-resizer = ResizePDF(
-    'J:/arquivos_digitalizados/bacharelado_em_educacao_fisica/em_andamento/bacharelado_em_educacao_fisica_2018(2)/',
-    'J:/arquivos_digitalizados/bacharelado_em_educacao_fisica/finalizados/bacharelado_em_educacao_fisica_2018(2)/',
-    "A4",
-    order_by="name",
-    use_custom_order=True
-)
+if __name__ == '__main__':
+
+    resizer = ResizePDF(
+        'J:/arquivos_digitalizados/bacharelado_em_educacao_fisica/em_andamento/bacharelado_em_educacao_fisica_2018(2)/',
+        'J:/arquivos_digitalizados/bacharelado_em_educacao_fisica/finalizados/bacharelado_em_educacao_fisica_2018(2)/',
+        "A4",
+        order_by="name",
+        use_custom_order=True
+    )
 
-resizer.retrieve_pdfs_per_folder()
+    resizer.retrieve_pdfs_per_folder()
 
-# resizer.resize()
+    # resizer.resize()
 
-# resizer.resize_using_custom_order()
+    # resizer.resize_using_custom_order()
 
-# resizer.generate_report()
\ No newline at end of file
+    # resizer.generate_report()
\ No newline at end of file
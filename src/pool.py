@@ -1,27 +1,164 @@
+import io
 import multiprocessing
-import asyncio
+import os
+import threading
+import time
+from dataclasses import replace
+from typing import Iterable, Iterator, List, Optional
+from engine import ResizeJob, ResizeResult, prepare_output
+from utils.fastcopy import atomic_output, clone_file
+from utils.profiling import profile_call
+from utils.source import open_source
 
-asyncio.open_connection(
-    
-)
+# Sentinel sent down a queue once per consumer to shut the stage down
+STOP = None
 
+def read_stage(jobs: multiprocessing.Queue, transform_queue: multiprocessing.Queue) -> None:
+    """
+    Load the bytes of each source with a single read, ahead of the transform workers.
+    """
+    while (job := jobs.get()) is not STOP:
+        result = ResizeResult(source_path=job.source_path, output_path=job.output_path, status="failed")
+        data = None
+        start = time.perf_counter()
+        try:
+            result.source_mtime_ns = os.stat(job.source_path).st_mtime_ns
+            with open_source(job.source_path, "memory") as source:
+                data = source.getvalue()
+            result.bytes_in = len(data)
+        except Exception as error:
+            result.error = f'{type(error).__name__}: {error}'
+        result.timings["fetch"] = time.perf_counter() - start
+        transform_queue.put((job, result, data))
 
-def producer(queue):
-    for i in range(5):
-        queue.put(i)
+def transform_data(job: ResizeJob, result: ResizeResult, data: bytes) -> Optional[bytes]:
+    """Resize a prefetched source, returning the output or None when the source is the output."""
+    render = prepare_output(job, io.BytesIO(data), result)
+    if render is None:
+        return None
+    start = time.perf_counter()
+    output = io.BytesIO()
+    result.pages = render(output)
+    result.timings["transform"] += time.perf_counter() - start
+    return output.getvalue()
 
-def consumer(queue):
-    while not queue.empty():
-        item = queue.get()
-        print(f'Item: {item}')
+def transform_stage(transform_queue: multiprocessing.Queue, write_queue: multiprocessing.Queue) -> None:
+    """
+    Resize the prefetched sources in memory; no file is touched here.
+    """
+    while (item := transform_queue.get()) is not STOP:
+        job, result, data = item
+        rendered = None
+        if data is not None:
+            try:
+                if job.profile:
+                    rendered, result.profile = profile_call(transform_data, job, result, data)
+                else:
+                    rendered = transform_data(job, result, data)
+            except Exception as error:
+                result.error = f'{type(error).__name__}: {error}'
+        write_queue.put((job, result, rendered))
+
+def write_stage(write_queue: multiprocessing.Queue, results: multiprocessing.Queue) -> None:
+    """
+    Write the resized documents (or clone the sources already in format) and report them.
+    """
+    while (item := write_queue.get()) is not STOP:
+        job, result, rendered = item
+        if result.error is None:
+            start = time.perf_counter()
+            try:
+                if rendered is None:
+                    result.passthrough = clone_file(job.source_path, job.output_path, job.link_mode)
+                else:
+                    with atomic_output(job.output_path) as output_file:
+                        output_file.write(rendered)
+                result.bytes_out = os.path.getsize(job.output_path)
+                result.status = "done"
+            except Exception as error:
+                result.error = f'{type(error).__name__}: {error}'
+            result.timings["write"] = time.perf_counter() - start
+        result.timings["total"] = sum(result.timings.values())
+        results.put(result)
+    results.put(STOP)
+
+def run_pipeline(
+        jobs: Iterable[ResizeJob],
+        workers: Optional[int]=None,
+        io_workers: int=2,
+        depth: int=2
+    ) -> Iterator[ResizeResult]:
+    """
+    Run a batch of resize jobs through separate read, transform and write stages.
+
+    Reader processes prefetch the sources and writer processes store the
+    outputs, so on a network share the transform workers never wait on I/O:
+    while they work, the next sources are being fetched and the previous
+    outputs written. The queues between the stages hold at most `depth`
+    documents per consumer, which bounds the memory used and makes a fast
+    stage wait for a slow one. Every stage stops after a STOP sentinel per
+    process, sent once the stage before it has finished.
+
+    Documents are not split in page ranges here; use `window` for large ones.
+
+    Args:
+        jobs (Iterable[ResizeJob]): The jobs to execute.
+        workers (int, optional): Number of transform processes. Defaults to the CPU count.
+        io_workers (int): Number of reader processes and of writer processes.
+        depth (int): Documents queued per consumer between two stages.
+
+    Returns:
+        Iterator[ResizeResult]: Results in completion order. The "fetch" timing is
+            the time spent reading the source in the read stage.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    jobs_queue = multiprocessing.Queue(io_workers * depth)
+    transform_queue = multiprocessing.Queue(workers * depth)
+    write_queue = multiprocessing.Queue(io_workers * depth)
+    results = multiprocessing.Queue()
+    stages: List[List[multiprocessing.Process]] = [
+        [multiprocessing.Process(target=read_stage, args=(jobs_queue, transform_queue), daemon=True) for _ in range(io_workers)],
+        [multiprocessing.Process(target=transform_stage, args=(transform_queue, write_queue), daemon=True) for _ in range(workers)],
+        [multiprocessing.Process(target=write_stage, args=(write_queue, results), daemon=True) for _ in range(io_workers)]
+    ]
+    for stage in stages:
+        for process in stage:
+            process.start()
+
+    def feed() -> None:
+        for job in jobs:
+            jobs_queue.put(replace(job, split_threshold=0))
+        for stage, queue in zip(stages, (jobs_queue, transform_queue, write_queue)):
+            for _ in stage:
+                queue.put(STOP)
+            for process in stage:
+                process.join()
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    finished = 0
+    try:
+        while finished < io_workers:
+            result = results.get()
+            if result is STOP:
+                finished += 1
+            else:
+                yield result
+        feeder.join()
+    finally:
+        if finished < io_workers:
+            for stage in stages:
+                for process in stage:
+                    process.terminate()
 
 if __name__ == '__main__':
-    queue = multiprocessing.Queue()
-    p1 = multiprocessing.Process(target=producer, args=(queue,))
-    p2 = multiprocessing.Process(target=consumer, args=(queue,))
-    
-    p1.start()
-    p2.start()
-    
-    p1.join()
-    p2.join()
\ No newline at end of file
+    import sys
+    from utils.bcolors import bcolors
+    a4 = (595.276, 841.89)
+    documents = [os.path.join(sys.argv[1], name) for name in sorted(os.listdir(sys.argv[1])) if name.lower().endswith('.pdf')]
+    output_path = sys.argv[2]
+    os.makedirs(output_path, exist_ok=True)
+    jobs = [ResizeJob(document, os.path.join(output_path, os.path.basename(document)), a4) for document in documents]
+    for result in run_pipeline(jobs):
+        color = bcolors.OKGREEN if result.status == "done" else bcolors.FAIL
+        print(f'{color}{result.name}: {result.status} {result.error or ""}{bcolors.ENDC}')
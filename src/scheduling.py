@@ -0,0 +1,66 @@
+import os
+from typing import Iterable, List, Literal, Optional, Sequence, Union
+from engine import FanOutJob, ResizeJob, ResizeResult
+
+Schedule = Literal["order", "largest-first"]
+
+# Bytes counted as one page of work: a scanned page weighs about 100 KB,
+# the bytes stand for image decoding and copying that the page count misses
+BYTES_PER_PAGE = 100 * 1024
+
+def estimate_cost(path: str, pages: Optional[int]=None) -> float:
+    """
+    Relative cost of resizing a document, in pages: its page count plus its
+    size in page equivalents. Missing files cost nothing.
+
+    Args:
+        pages (int, optional): The page count when already known (metadata catalog).
+            Otherwise the size alone is used: the source is never opened.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return 0.0
+    return (pages or 0) + size / BYTES_PER_PAGE
+
+def largest_first(jobs: Sequence[Union[ResizeJob, FanOutJob]]) -> List[Union[ResizeJob, FanOutJob]]:
+    """
+    Sort the jobs by decreasing estimated cost (see `estimate_cost`).
+
+    Started last, a large document keeps one worker busy long after the
+    others ran out of work; started first, the small ones fill in around it.
+    Only the page counts the jobs carry (see ResizeJob.source_pages, from the
+    metadata catalog) are used, and a stat otherwise: probing every source up
+    front would read the share before the first job starts, outside the
+    staging cache.
+    """
+    costs = [estimate_cost(job.source_path, job.source_pages or None) for job in jobs]
+    order = sorted(range(len(jobs)), key=lambda index: -costs[index])
+    return [jobs[index] for index in order]
+
+class OrderedResults:
+    """
+    Reorder buffer handing back results in the order of the jobs, whatever
+    the order they complete in. A fan-out job hands back one result per format.
+    """
+
+    def __init__(self, jobs: Iterable[Union[ResizeJob, FanOutJob]]) -> None:
+        self.__order = [
+            part.output_path
+            for job in jobs
+            for part in (job.jobs if isinstance(job, FanOutJob) else (job,))
+        ]
+        self.__next = 0
+        self.__arrived: dict[str, ResizeResult] = {}
+
+    def add(self, result: ResizeResult) -> List[ResizeResult]:
+        """
+        Returns:
+            List[ResizeResult]: The results that are next in order, possibly none.
+        """
+        self.__arrived[result.output_path] = result
+        ready = []
+        while self.__next < len(self.__order) and self.__order[self.__next] in self.__arrived:
+            ready.append(self.__arrived.pop(self.__order[self.__next]))
+            self.__next += 1
+        return ready
@@ -0,0 +1,184 @@
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, replace
+from typing import Callable, List, Optional
+from engine import ResizeJob, ResizeResult, resize_buffer, resize_document
+
+# Inline documents travel base64 encoded on a single line
+MAX_LINE = 512 * 1024 * 1024
+
+def run_request(job: ResizeJob, data: Optional[bytes]) -> tuple[ResizeResult, Optional[bytes]]:
+    """Worker entry point: resize a file on disk, or the bytes sent with the request."""
+    if data is None:
+        return resize_document(job), None
+    return resize_buffer(job, data)
+
+class JobServer:
+    """
+    Resize service speaking JSON lines over a local TCP or Unix socket.
+
+    Each line sent by a client is a job, either a file on disk or an inline document:
+
+        {"id": 1, "path": "/scans/a.pdf", "output": "/done/a.pdf", "format": "A4"}
+        {"id": 2, "data": "<base64 PDF>", "format": "A3"}
+
+    "output" and "format" are optional; an "output" outside the output folder of
+    the server is refused. For each job a line comes back as soon
+    as it is done, in completion order, with the fields of ResizeResult plus
+    the "id" of the job and, for inline jobs, the resized document in "data".
+
+    Jobs run in a ProcessPoolExecutor. At most `max_in_flight` run or wait in
+    it at once, shared by all clients, and each client also has its own queue
+    of `client_queue` jobs: once it is full the server stops reading from that
+    client, so a client sending a large batch slows down itself and not the
+    others.
+    """
+
+    def __init__(
+            self,
+            create_job: Callable[[str, str, Optional[str]], ResizeJob],
+            output_for: Callable[[str], str],
+            output_folder: str,
+            workers: Optional[int]=None,
+            max_in_flight: Optional[int]=None,
+            client_queue: int=16
+        ) -> None:
+        """
+        Args:
+            create_job (Callable): Builds the job of a source path, output path and
+                optional format (ResizePDF.create_job).
+            output_for (Callable): Output path of a source sent without "output".
+            output_folder (str): Folder the outputs sent by clients must be inside.
+            workers (int, optional): Processes of the executor. Defaults to the CPU count.
+            max_in_flight (int, optional): Jobs submitted to the executor at once.
+                Defaults to twice the number of processes.
+            client_queue (int): Jobs read ahead from a single client.
+        """
+        self.__create_job = create_job
+        self.__output_for = output_for
+        self.__output_folder = os.path.realpath(output_folder)
+        # Forked workers would inherit the sockets of the clients connected at that
+        # moment and keep them open after the server closes them
+        self.__executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self.__slots = asyncio.Semaphore(max_in_flight or self.__executor._max_workers * 2)
+        self.__client_queue = client_queue
+
+    def __job_for(self, request: dict) -> tuple[ResizeJob, Optional[bytes]]:
+        if "data" in request:
+            data = base64.b64decode(request["data"])
+            job = self.__create_job(request.get("name", "inline.pdf"), "", request.get("format"))
+        else:
+            data = None
+            job = self.__create_job(request["path"], self.__output_of(request), request.get("format"))
+        # A job of the server is a single process, large documents use `window` instead
+        return replace(job, split_threshold=0), data
+
+    def __output_of(self, request: dict) -> str:
+        output = request.get("output")
+        if not output:
+            return self.__output_for(request["path"])
+        # Resolved, so neither ".." nor a symbolic link gets out of the folder,
+        # and the path written is the one checked
+        resolved = os.path.realpath(output)
+        if os.path.commonpath([self.__output_folder, resolved]) != self.__output_folder:
+            raise PermissionError(f'output outside of {self.__output_folder}: {output}')
+        return resolved
+
+    async def __run(self, request: dict, respond: Callable[[dict], None]) -> None:
+        try:
+            job, data = self.__job_for(request)
+            loop = asyncio.get_running_loop()
+            result, output = await loop.run_in_executor(self.__executor, run_request, job, data)
+            response = {"id": request.get("id"), **asdict(result)}
+            if output is not None:
+                response["data"] = base64.b64encode(output).decode()
+        except Exception as error:
+            response = {"id": request.get("id"), "status": "failed", "error": f'{type(error).__name__}: {error}'}
+        finally:
+            self.__slots.release()
+        await respond(response)
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        requests: asyncio.Queue = asyncio.Queue(self.__client_queue)
+
+        async def respond(response: dict) -> None:
+            try:
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+        async def dispatch() -> None:
+            running = set()
+            while (request := await requests.get()) is not None:
+                await self.__slots.acquire()
+                task = asyncio.create_task(self.__run(request, respond))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            if running:
+                await asyncio.wait(running)
+
+        dispatcher = asyncio.create_task(dispatch())
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('a job must be a JSON object')
+                except ValueError as error:
+                    await respond({"id": None, "status": "failed", "error": f'Invalid request: {error}'})
+                    continue
+                await requests.put(request)
+        finally:
+            await requests.put(None)
+            await dispatcher
+            writer.close()
+
+    async def serve(self, host: str='127.0.0.1', port: int=8765, socket_path: Optional[str]=None) -> None:
+        """Accept clients until cancelled, on `socket_path` when given, otherwise on host:port."""
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle_client, socket_path, limit=MAX_LINE)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port, limit=MAX_LINE)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.__executor.shutdown(cancel_futures=True)
+
+async def submit_jobs(
+        requests: List[dict],
+        host: str='127.0.0.1',
+        port: int=8765,
+        socket_path: Optional[str]=None
+    ) -> List[dict]:
+    """
+    Minimal client: send `requests` to a JobServer and collect one response per request.
+
+    Returns:
+        List[dict]: The responses, in completion order.
+    """
+    if socket_path:
+        reader, writer = await asyncio.open_unix_connection(socket_path, limit=MAX_LINE)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE)
+
+    async def send() -> None:
+        for request in requests:
+            writer.write(json.dumps(request).encode() + b'\n')
+            await writer.drain()
+        writer.write_eof()
+
+    sender = asyncio.create_task(send())
+    responses = []
+    while line := await reader.readline():
+        responses.append(json.loads(line))
+    await sender
+    writer.close()
+    return responses
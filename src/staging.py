@@ -0,0 +1,310 @@
+import hashlib
+import os
+import queue
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import replace
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+from engine import FanOutJob, ResizeJob, ResizeResult
+from utils.fastcopy import PARTIAL_SUFFIX, copy_batch, copy_file
+
+# Sentinel shutting the write-back thread down
+STOP = None
+
+def staged_name(path: str) -> str:
+    """Name of the local copy of `path`: unique per path, still readable in a listing."""
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return f'{digest}-{os.path.basename(path)}'
+
+def job_uses(job: Union[ResizeJob, FanOutJob]) -> int:
+    """Results a job comes back with, each one releasing its source once."""
+    return len(job.jobs) if isinstance(job, FanOutJob) else 1
+
+class StagingCache:
+    """
+    Local copies of the sources on a slow network share, fetched ahead of the jobs.
+
+    A source is copied to `folder`/in with one sequential read, by a pool of
+    `threads`, so the many small random reads pypdf makes hit the local disk
+    instead of paying the latency of the share each time. The copies take at
+    most `budget` bytes: the least recently used ones that no job holds are
+    evicted to make room, and prefetching pauses while the budget is full. A
+    source larger than the budget is read from the share. Copies are kept
+    between runs and reused while the source keeps its size and mtime.
+
+    Outputs are written to `folder`/out and copied to the share by a
+    WriteBack, `batch` files at most at once.
+
+    The copies go through utils.fastcopy.copy_file, so a local folder
+    throttled with utils.source.throttle_share can stand in for the share.
+    """
+
+    def __init__(self, folder: str, budget: int, threads: int=4, batch: int=8) -> None:
+        self.__input_folder = os.path.join(folder, 'in')
+        self.__output_folder = os.path.join(folder, 'out')
+        self.__budget = budget
+        self.__batch = batch
+        # The outputs left by an interrupted run never reached the share, they are made again
+        shutil.rmtree(self.__output_folder, ignore_errors=True)
+        os.makedirs(self.__input_folder, exist_ok=True)
+        os.makedirs(self.__output_folder, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__fetcher = ThreadPoolExecutor(threads)
+        self.__fetches: dict[str, Future] = {}
+        self.__sources: dict[str, str] = {}
+        self.__holds: dict[str, int] = {}
+        # Size of every local copy by name, least recently used first
+        self.__sizes: OrderedDict[str, int] = OrderedDict()
+        copies = [entry for entry in os.scandir(self.__input_folder) if entry.is_file()]
+        for entry in sorted(copies, key=lambda entry: entry.stat().st_ctime):
+            if entry.name.endswith(PARTIAL_SUFFIX):
+                os.remove(entry.path)
+            else:
+                self.__sizes[entry.name] = entry.stat().st_size
+        self.__used = sum(self.__sizes.values())
+
+    @property
+    def output_folder(self) -> str:
+        return self.__output_folder
+
+    @property
+    def used(self) -> int:
+        """Bytes taken by the local copies."""
+        return self.__used
+
+    def write_back(self) -> 'WriteBack':
+        return WriteBack(self.__batch)
+
+    def close(self) -> None:
+        self.__fetcher.shutdown(wait=True, cancel_futures=True)
+
+    def prefetch(self, path: str, uses: int=1) -> bool:
+        """
+        Start copying `path` locally, for `uses` jobs that will each `release` it.
+
+        Returns:
+            bool: False when the budget is full of copies still in use: try again
+                once some are released. True otherwise, including for the sources
+                that are never staged (missing, or larger than the budget).
+        """
+        name = staged_name(path)
+        with self.__lock:
+            if path in self.__fetches:
+                self.__holds[name] += uses
+                self.__sizes.move_to_end(name)
+                return True
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return True
+            if size > self.__budget:
+                return True
+            # A copy left by an earlier run is accounted again once its fetch is started
+            self.__used -= self.__sizes.pop(name, 0)
+            if not self.__make_room(size):
+                return False
+            self.__sizes[name] = size
+            self.__used += size
+            self.__holds[name] = uses
+            self.__sources[name] = path
+            self.__fetches[path] = self.__fetcher.submit(self.__fetch, path, name)
+            return True
+
+    def acquire(self, path: str, uses: int=1) -> str:
+        """
+        Wait for the local copy of `path`, fetching it now when it was not prefetched.
+
+        Returns:
+            str: The path of the local copy, or `path` itself when the source
+                could not be staged.
+        """
+        with self.__lock:
+            future = self.__fetches.get(path)
+        if future is None:
+            if not self.prefetch(path, uses):
+                return path
+            with self.__lock:
+                future = self.__fetches.get(path)
+            if future is None:
+                return path
+        return future.result() or path
+
+    def release(self, path: str) -> None:
+        """Mark a use of `path` as finished, its copy may be evicted once none is left."""
+        name = staged_name(path)
+        with self.__lock:
+            if path in self.__fetches:
+                self.__holds[name] -= 1
+                self.__sizes.move_to_end(name)
+
+    def __make_room(self, size: int) -> bool:
+        """Evict the least recently used copies nobody holds until `size` bytes fit in the budget."""
+        for name in list(self.__sizes):
+            if self.__used + size <= self.__budget:
+                break
+            if self.__holds.get(name, 0) > 0:
+                continue
+            try:
+                os.remove(os.path.join(self.__input_folder, name))
+            except FileNotFoundError:
+                pass
+            self.__used -= self.__sizes.pop(name)
+            self.__holds.pop(name, None)
+            source = self.__sources.pop(name, None)
+            if source is not None:
+                self.__fetches.pop(source, None)
+        return self.__used + size <= self.__budget
+
+    def __fetch(self, path: str, name: str) -> Optional[str]:
+        local_path = os.path.join(self.__input_folder, name)
+        temporary = local_path + PARTIAL_SUFFIX
+        try:
+            stat = os.stat(path)
+            if os.path.isfile(local_path):
+                local_stat = os.stat(local_path)
+                if local_stat.st_size == stat.st_size and local_stat.st_mtime_ns == stat.st_mtime_ns:
+                    return local_path
+            copy_file(path, temporary)
+            os.utime(temporary, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            os.replace(temporary, local_path)
+            return local_path
+        except OSError:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            # Read from the share instead, where the job reports the actual error
+            return None
+
+class WriteBack:
+    """
+    Copy local outputs to their place on the share from a background thread.
+
+    Outputs queue up while a batch is being written and leave together in
+    the next one, up to `batch` files: every file is synced and renamed into
+    place as with `atomic_output`, each folder is synced once per batch.
+    """
+
+    def __init__(self, batch: int=8) -> None:
+        self.__batch = batch
+        self.__pending: queue.Queue = queue.Queue()
+        self.__done: queue.SimpleQueue = queue.SimpleQueue()
+        self.__in_flight = 0
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    @property
+    def in_flight(self) -> int:
+        """Number of outputs submitted that were not handed back by `completed` yet."""
+        return self.__in_flight
+
+    def submit(self, local_path: str, result: ResizeResult) -> None:
+        """Queue the copy of `local_path` to `result.output_path`."""
+        self.__in_flight += 1
+        self.__pending.put((local_path, result))
+
+    def completed(self, block: bool=False) -> List[ResizeResult]:
+        """
+        Returns:
+            List[ResizeResult]: The results whose output is on the share (or failed to
+                get there), waiting for at least one when `block`.
+        """
+        results = []
+        try:
+            if block and self.__in_flight:
+                results.append(self.__done.get())
+            while True:
+                results.append(self.__done.get_nowait())
+        except queue.Empty:
+            pass
+        self.__in_flight -= len(results)
+        return results
+
+    def close(self) -> None:
+        self.__pending.put(STOP)
+        self.__thread.join()
+
+    def __run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self.__pending.get()
+            if item is STOP:
+                return
+            batch = [item]
+            while len(batch) < self.__batch:
+                try:
+                    item = self.__pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            start = time.perf_counter()
+            try:
+                copy_batch((local_path, result.output_path) for local_path, result in batch)
+            except Exception as error:
+                for _, result in batch:
+                    result.status = "failed"
+                    result.error = f'Copy to the share failed, {type(error).__name__}: {error}'
+            for local_path, result in batch:
+                if os.path.exists(local_path):
+                    os.remove(local_path)
+                result.timings["upload"] = (time.perf_counter() - start) / len(batch)
+                self.__done.put(result)
+
+def run_staged(
+        jobs: Iterable[Union[ResizeJob, FanOutJob]],
+        run: Callable[[Iterable[Union[ResizeJob, FanOutJob]]], Iterator[ResizeResult]],
+        cache: StagingCache
+    ) -> Iterator[ResizeResult]:
+    """
+    Run a batch through `run` (run_batch, run_pipeline...) on local copies.
+
+    Sources are prefetched in job order as far as the budget of the cache
+    allows, every job is handed to `run` with its local source and a local
+    output, and outputs go back to the share in the background. The results
+    carry the share paths again; a result is only yielded once its output
+    is on the share, so the journal never lists an output that is not there.
+
+    Returns:
+        Iterator[ResizeResult]: Results in completion order, the "upload" timing being
+            the share of its batch copy.
+    """
+    jobs = list(jobs)
+    originals: dict[str, ResizeJob] = {}
+
+    def stage(job: Union[ResizeJob, FanOutJob], local_source: str) -> Union[ResizeJob, FanOutJob]:
+        staged_parts = []
+        for part in (job.jobs if isinstance(job, FanOutJob) else (job,)):
+            local_output = os.path.join(cache.output_folder, staged_name(part.output_path))
+            originals[local_output] = part
+            staged_parts.append(replace(part, source_path=local_source, output_path=local_output))
+        return FanOutJob(tuple(staged_parts)) if isinstance(job, FanOutJob) else staged_parts[0]
+
+    def staged_jobs() -> Iterator[Union[ResizeJob, FanOutJob]]:
+        ahead = 0
+        for index, job in enumerate(jobs):
+            ahead = max(ahead, index)
+            while ahead < len(jobs) and cache.prefetch(jobs[ahead].source_path, job_uses(jobs[ahead])):
+                ahead += 1
+            yield stage(job, cache.acquire(job.source_path, job_uses(job)))
+
+    write_back = cache.write_back()
+    try:
+        for result in run(staged_jobs()):
+            part = originals.pop(result.output_path)
+            cache.release(part.source_path)
+            local_output = result.output_path
+            result.source_path = part.source_path
+            result.output_path = part.output_path
+            if result.status == "done":
+                write_back.submit(local_output, result)
+            else:
+                yield result
+            yield from write_back.completed()
+        while write_back.in_flight:
+            yield from write_back.completed(block=True)
+    finally:
+        write_back.close()
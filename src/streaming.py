@@ -0,0 +1,405 @@
+import hashlib
+import io
+import zlib
+import pypdf
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Literal, Optional
+from utils.profiling import checkpoint
+from utils.source import open_source
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    PdfObject,
+    StreamObject
+)
+
+INHERITABLE_KEYS = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+# Output optimization levels, each one including the previous ones
+Optimize = Literal["none", "compress", "dedup", "objstm"]
+OPTIMIZE_LEVELS = ["none", "compress", "dedup", "objstm"]
+OBJECTS_PER_STREAM = 100
+
+class StreamingPdfWriter:
+    """
+    PDF writer that serializes every page as soon as it is added.
+
+    pypdf's PdfWriter keeps the whole document in memory until `write()`.
+    Here each added page and the objects it references are written to the
+    output immediately; afterwards only their object numbers and byte offsets
+    are kept. Objects shared between pages (fonts, letterheads) are written
+    once and referenced by number afterwards.
+
+    The `optimize` level shrinks the output:
+        "compress" flate-compresses the streams written uncompressed (content streams).
+        "dedup" also writes identical streams once, such as the same stamp or
+            letterhead image embedded again by every scanned page.
+        "objstm" also packs the objects that are not streams into compressed
+            object streams, indexed by a cross-reference stream instead of a table.
+    """
+
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, stream: BinaryIO, optimize: Optimize="none") -> None:
+        level = OPTIMIZE_LEVELS.index(optimize)
+        self.__compress = level >= 1
+        self.__deduplicate = level >= 2
+        self.__object_streams = level >= 3
+        self.__digests: dict[bytes, int] = {}
+        self.__packed: dict[int, tuple[int, int]] = {}
+        self.__to_pack: List[tuple[int, bytes]] = []
+        self.__stream = stream
+        self.__position = 0
+        self.__offsets: dict[int, int] = {}
+        self.__next_number = 3
+        self.__translated: dict[tuple[int, int, int], int] = {}
+        self.__page_numbers: dict[tuple[int, int, int], int] = {}
+        self.__kids: List[int] = []
+        self.__pending: List[tuple[int, PdfObject]] = []
+        self.__write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self) -> int:
+        return len(self.__kids)
+
+    def __write(self, data: bytes) -> None:
+        self.__stream.write(data)
+        self.__position += len(data)
+
+    def __allocate(self) -> int:
+        number = self.__next_number
+        self.__next_number += 1
+        return number
+
+    @staticmethod
+    def __key(reference: IndirectObject) -> tuple[int, int, int]:
+        return id(reference.pdf), reference.idnum, reference.generation
+
+    def reserve_pages(self, references: List[IndirectObject]) -> None:
+        """
+        Give the source pages that will be added their output object numbers up front,
+        so links between them point at the resized pages instead of copying the originals.
+        """
+        for reference in references:
+            self.__page_numbers.setdefault(self.__key(reference), self.__allocate())
+
+    def release(self, pdf: pypdf.PdfReader) -> None:
+        """
+        Forget the object numbers given to the objects of a source that is done,
+        before it is closed: a later reader could be allocated at the same address.
+        """
+        for numbers in (self.__translated, self.__page_numbers):
+            for key in [key for key in numbers if key[0] == id(pdf)]:
+                del numbers[key]
+
+    def __store(self, obj: PdfObject) -> int:
+        """Queue `obj` under a new number, or return the number of an identical stream already queued."""
+        if not (self.__deduplicate and isinstance(obj, StreamObject)):
+            number = self.__allocate()
+            self.__pending.append((number, obj))
+            return number
+        obj = self.__serialize(obj)
+        dictionary = io.BytesIO()
+        DictionaryObject({key: value for key, value in obj.items() if key != "/Length"}).write_to_stream(dictionary)
+        digest = hashlib.sha256(dictionary.getvalue() + b"stream" + obj._data).digest()
+        if digest not in self.__digests:
+            self.__digests[digest] = self.__allocate()
+            self.__pending.append((self.__digests[digest], obj))
+        return self.__digests[digest]
+
+    def add_object(self, obj: PdfObject) -> IndirectObject:
+        """Queue a new object for writing and return its reference (the `register` of wrap_page)."""
+        return IndirectObject(self.__store(obj), 0, self)
+
+    def __translate(self, obj: PdfObject) -> PdfObject:
+        """Copy `obj`, replacing references to the source documents by output object numbers."""
+        if isinstance(obj, IndirectObject):
+            if obj.pdf is self:
+                return obj
+            key = self.__key(obj)
+            if key in self.__page_numbers:
+                return IndirectObject(self.__page_numbers[key], 0, self)
+            if key not in self.__translated:
+                target = obj.get_object()
+                if isinstance(target, DictionaryObject) and target.get("/Type") == "/Pages":
+                    return IndirectObject(self.PAGES, 0, self)
+                if isinstance(target, DictionaryObject) and target.get("/Type") == "/Page":
+                    return NullObject()
+                self.__translated[key] = self.__store(target)
+            return IndirectObject(self.__translated[key], 0, self)
+        if isinstance(obj, StreamObject):
+            return self.add_object(obj)
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({key: self.__translate(value) for key, value in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.__translate(value) for value in obj)
+        return obj
+
+    def __serialize(self, obj: PdfObject) -> PdfObject:
+        """Translate the top level of an object about to be written, keeping streams as streams."""
+        if isinstance(obj, EncodedStreamObject):
+            stream = EncodedStreamObject()
+            stream._data = obj._data
+        elif isinstance(obj, StreamObject) and self.__compress:
+            stream = EncodedStreamObject()
+            stream._data = zlib.compress(obj.get_data())
+            stream[NameObject("/Filter")] = NameObject("/FlateDecode")
+        elif isinstance(obj, StreamObject):
+            stream = DecodedStreamObject()
+            stream.set_data(obj.get_data())
+        else:
+            return self.__translate(obj)
+        skipped_keys = ("/Length",) if isinstance(stream, EncodedStreamObject) else ("/Length", "/Filter", "/DecodeParms")
+        for key, value in obj.items():
+            if key not in skipped_keys:
+                stream[key] = self.__translate(value)
+        return stream
+
+    def __write_object(self, number: int, obj: PdfObject) -> None:
+        if self.__object_streams and not isinstance(obj, StreamObject):
+            packed = io.BytesIO()
+            obj.write_to_stream(packed)
+            self.__to_pack.append((number, packed.getvalue()))
+            if len(self.__to_pack) >= OBJECTS_PER_STREAM:
+                self.__write_object_stream()
+            return
+        self.__offsets[number] = self.__position
+        self.__write(f"{number} 0 obj\n".encode())
+        obj.write_to_stream(self)
+        self.__write(b"\nendobj\n")
+
+    def __write_object_stream(self) -> None:
+        """Write the objects waiting to be packed as one compressed object stream."""
+        number = self.__allocate()
+        offsets = []
+        body = io.BytesIO()
+        for index, (packed_number, data) in enumerate(self.__to_pack):
+            offsets.append(f"{packed_number} {body.tell()}")
+            body.write(data + b"\n")
+            self.__packed[packed_number] = (number, index)
+        header = " ".join(offsets).encode() + b"\n"
+        stream = EncodedStreamObject()
+        stream._data = zlib.compress(header + body.getvalue())
+        stream.update({
+            NameObject("/Type"): NameObject("/ObjStm"),
+            NameObject("/N"): NumberObject(len(self.__to_pack)),
+            NameObject("/First"): NumberObject(len(header)),
+            NameObject("/Filter"): NameObject("/FlateDecode")
+        })
+        self.__to_pack = []
+        self.__write_object(number, stream)
+
+    def __write_xref_stream(self) -> None:
+        """Write the cross-reference stream and the end of the file, for object streams."""
+        number = self.__allocate()
+        self.__offsets[number] = self.__position
+        width = max(4, (self.__position.bit_length() + 7) // 8)
+        rows = bytearray()
+        for entry in range(self.__next_number):
+            if entry in self.__offsets:
+                rows += b"\x01" + self.__offsets[entry].to_bytes(width, "big") + b"\x00\x00"
+            elif entry in self.__packed:
+                object_stream, index = self.__packed[entry]
+                rows += b"\x02" + object_stream.to_bytes(width, "big") + index.to_bytes(2, "big")
+            else:
+                rows += b"\x00" + bytes(width) + (b"\xff\xff" if entry == 0 else b"\x00\x00")
+        stream = EncodedStreamObject()
+        stream._data = zlib.compress(bytes(rows))
+        stream.update({
+            NameObject("/Type"): NameObject("/XRef"),
+            NameObject("/Size"): NumberObject(self.__next_number),
+            NameObject("/W"): ArrayObject([NumberObject(1), NumberObject(width), NumberObject(2)]),
+            NameObject("/Root"): IndirectObject(self.CATALOG, 0, self),
+            NameObject("/Filter"): NameObject("/FlateDecode")
+        })
+        self.__write(f"{number} 0 obj\n".encode())
+        stream.write_to_stream(self)
+        self.__write(f"\nendobj\nstartxref\n{self.__offsets[number]}\n%%EOF\n".encode())
+
+    def write(self, data: bytes) -> int:
+        """File-like entry point used by pypdf's `write_to_stream`."""
+        self.__write(data)
+        return len(data)
+
+    def flush(self) -> None:
+        """Write every queued object, including the ones they pull in."""
+        while self.__pending:
+            number, obj = self.__pending.pop()
+            self.__write_object(number, self.__serialize(obj))
+
+    def add_page(self, page: pypdf.PageObject, source: Optional[IndirectObject]=None) -> None:
+        """
+        Write `page` and everything it references that was not written yet.
+
+        Args:
+            source (IndirectObject, optional): The source page `page` replaces, when it is
+                a new page built from it. Defaults to the page's own reference.
+        """
+        source = source or page.indirect_reference
+        number = self.__page_numbers.get(self.__key(source)) if source is not None else None
+        if number is None:
+            number = self.__allocate()
+        page_dict = DictionaryObject({
+            key: value for key, value in page.items() if key not in ("/Parent", "/StructParents")
+        })
+        page_dict = self.__translate(page_dict)
+        page_dict[NameObject("/Parent")] = IndirectObject(self.PAGES, 0, self)
+        self.__write_object(number, page_dict)
+        self.__kids.append(number)
+        self.flush()
+
+    def close(self) -> None:
+        """Write the page tree, the catalog, the cross-reference table and the trailer."""
+        self.flush()
+        self.__write_object(self.PAGES, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(IndirectObject(number, 0, self) for number in self.__kids),
+            NameObject("/Count"): NumberObject(len(self.__kids))
+        }))
+        self.__write_object(self.CATALOG, DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(self.PAGES, 0, self)
+        }))
+        if self.__object_streams:
+            if self.__to_pack:
+                self.__write_object_stream()
+            self.__write_xref_stream()
+            return
+        xref_position = self.__position
+        self.__write(f"xref\n0 {self.__next_number}\n0000000000 65535 f \n".encode())
+        for number in range(1, self.__next_number):
+            if number in self.__offsets:
+                self.__write(f"{self.__offsets[number]:010d} 00000 n \n".encode())
+            else:
+                self.__write(b"0000000000 65535 f \n")
+        self.__write(
+            f"trailer\n<< /Size {self.__next_number} /Root {self.CATALOG} 0 R >>\nstartxref\n{xref_position}\n%%EOF\n".encode()
+        )
+
+def write_pages(pages: Iterable[pypdf.PageObject], output: BinaryIO, optimize: Optimize="none") -> int:
+    """
+    Write already resized pages (of a PdfWriter or of readers) through a StreamingPdfWriter.
+
+    Returns:
+        int: The number of pages written.
+    """
+    pages = list(pages)
+    writer = StreamingPdfWriter(output, optimize)
+    writer.reserve_pages([page.indirect_reference for page in pages if page.indirect_reference is not None])
+    for page in pages:
+        writer.add_page(page)
+    writer.close()
+    return writer.page_count
+
+def probe_pages(path: str) -> Optional[int]:
+    """
+    Read the page count of a PDF from its page tree root, without loading any page.
+
+    Only the cross-reference table, the catalog and the root /Pages node are
+    read, a few KB at the end and the start of the file.
+
+    Returns:
+        int, optional: The /Count of the page tree, None when the file cannot be parsed.
+    """
+    try:
+        with open_source(path) as source:
+            reader = pypdf.PdfReader(source)
+            return int(reader.trailer["/Root"]["/Pages"]["/Count"])
+    except Exception:
+        return None
+
+def iter_page_references(reader: pypdf.PdfReader) -> Iterator[tuple[IndirectObject, dict]]:
+    """
+    Walk the page tree of `reader` without building its page list.
+
+    Yields:
+        tuple: The reference of each page, in order, and the attributes it
+            inherits from its parents (still unresolved references).
+    """
+    root = reader.trailer["/Root"].raw_get("/Pages")
+    stack: List[tuple[IndirectObject, dict]] = [(root, {})]
+    while stack:
+        reference, inherited = stack.pop()
+        node = reference.get_object()
+        if node.get("/Type") == "/Pages" or "/Kids" in node:
+            inherited = dict(inherited)
+            for key in INHERITABLE_KEYS:
+                if key in node:
+                    inherited[key] = node.raw_get(key)
+            stack.extend((kid, inherited) for kid in reversed(node["/Kids"]))
+        else:
+            yield reference, inherited
+
+def load_page(reader: pypdf.PdfReader, reference: IndirectObject, inherited: dict) -> pypdf.PageObject:
+    """Build a fresh PageObject for `reference`, filling in the inherited attributes."""
+    page = pypdf.PageObject(reader, reference)
+    page.update(reference.get_object())
+    for key, value in inherited.items():
+        if key not in page:
+            page[NameObject(key)] = value
+    return page
+
+def stream_pages(
+        reader: pypdf.PdfReader,
+        output: BinaryIO,
+        transform: Callable[[pypdf.PageObject, Callable[[PdfObject], IndirectObject]], pypdf.PageObject],
+        window: int,
+        page_range: Optional[tuple[int, int]]=None,
+        optimize: Optimize="none"
+    ) -> int:
+    """
+    Transform the pages of `reader` and write them to `output` `window` pages at a time.
+
+    After every window the reader cache is dropped, so the memory held by a
+    worker is bounded by the largest window of pages instead of the document:
+    roughly the interpreter and pypdf (~40 MB), the cross-reference table of
+    the source, the object-number maps (a few bytes per object) and the
+    decoded content and resources of `window` pages.
+
+    Args:
+        transform (Callable): Receives each page and the writer's `register`
+            callback and returns the page to write.
+        window (int): Number of pages between two cache drops.
+        page_range (tuple[int, int], optional): Only write pages [start, stop).
+        optimize (Optimize): Output optimization level, see StreamingPdfWriter.
+
+    Returns:
+        int: The number of pages written.
+    """
+    writer = StreamingPdfWriter(output, optimize)
+    append_pages(writer, reader, transform, window, page_range)
+    writer.close()
+    return writer.page_count
+
+def append_pages(
+        writer: StreamingPdfWriter,
+        reader: pypdf.PdfReader,
+        transform: Callable[[pypdf.PageObject, Callable[[PdfObject], IndirectObject]], pypdf.PageObject],
+        window: int,
+        page_range: Optional[tuple[int, int]]=None
+    ) -> int:
+    """
+    Transform the pages of `reader` into an open `writer`, `window` pages at a time.
+
+    The body of `stream_pages`; called once per source it writes several
+    documents, one after the other, into a single output.
+
+    Returns:
+        int: The number of pages written.
+    """
+    pages = list(iter_page_references(reader))
+    if page_range is not None:
+        pages = pages[page_range[0]:page_range[1]]
+    writer.reserve_pages([reference for reference, _ in pages])
+    for start in range(0, len(pages), window):
+        for reference, inherited in pages[start:start + window]:
+            writer.add_page(transform(load_page(reader, reference, inherited), writer.add_object), reference)
+        checkpoint()
+        reader.resolved_objects.clear()
+    return len(pages)
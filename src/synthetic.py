@@ -0,0 +1,134 @@
+import os
+import random
+import zlib
+import pypdf
+from typing import List, Literal, Sequence
+from pypdf.generic import (
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    NameObject,
+    NumberObject
+)
+from streaming import StreamingPdfWriter
+
+Content = Literal["text", "image", "mixed"]
+
+# Page sizes seen in the scans, in points: A4 exact and as scanners round it, Letter, Legal, A3, A5 and A4 landscape
+MIXED_SIZES = [
+    (595.276, 841.89),
+    (595.0, 842.0),
+    (612.0, 792.0),
+    (612.0, 1008.0),
+    (841.89, 1190.551),
+    (419.528, 595.276),
+    (841.89, 595.276)
+]
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore".split()
+
+def text_stream(rng: random.Random, width: float, height: float) -> EncodedStreamObject:
+    lines = []
+    for line in range(int((height - 72) // 14)):
+        words = " ".join(rng.choice(WORDS) for _ in range(int((width - 72) // 30)))
+        lines.append(f"1 0 0 1 36 {height - 36 - line * 14:.2f} Tm ({words}) Tj")
+    stream = EncodedStreamObject()
+    stream._data = zlib.compress(("BT /F1 10 Tf\n" + "\n".join(lines) + "\nET").encode())
+    stream[NameObject("/Filter")] = NameObject("/FlateDecode")
+    return stream
+
+def image_stream(rng: random.Random, image_size: tuple[int, int]) -> EncodedStreamObject:
+    """A grayscale image of noise, which compresses about as badly as a scanned page."""
+    image = EncodedStreamObject()
+    image._data = zlib.compress(rng.randbytes(image_size[0] * image_size[1]), 1)
+    image.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(image_size[0]),
+        NameObject("/Height"): NumberObject(image_size[1]),
+        NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+        NameObject("/Filter"): NameObject("/FlateDecode")
+    })
+    return image
+
+def generate_pdf(
+        path: str,
+        pages: int,
+        content: Content="text",
+        sizes: Sequence[tuple[float, float]]=MIXED_SIZES,
+        seed: int=0,
+        image_size: tuple[int, int]=(300, 424)
+    ) -> int:
+    """
+    Write a synthetic PDF to `path`, streaming its pages so any page count fits in memory.
+
+    Args:
+        pages (int): Number of pages, from 1 up to 100k and more.
+        content (Content): "text" pages of Helvetica lines, "image" pages holding a
+            full-page scan-like image, or "mixed" to pick one of both per page.
+        sizes (Sequence): Page sizes to pick from at random, in points.
+        seed (int): Seed of the generator, the same arguments give the same file.
+        image_size (tuple[int, int]): Pixels of the page images.
+
+    Returns:
+        int: The size of the file written, in bytes.
+    """
+    rng = random.Random(seed)
+    with open(path, 'wb') as file:
+        writer = StreamingPdfWriter(file)
+        font = writer.add_object(DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica")
+        }))
+        for _ in range(pages):
+            width, height = rng.choice(sizes)
+            page = pypdf.PageObject.create_blank_page(None, width, height)
+            page_content = content if content != "mixed" else rng.choice(["text", "image"])
+            if page_content == "text":
+                resources = {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})}
+                stream = text_stream(rng, width, height)
+            else:
+                resources = {NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): writer.add_object(image_stream(rng, image_size))})}
+                stream = DecodedStreamObject()
+                stream.set_data(f"q {width:.3f} 0 0 {height:.3f} 0 0 cm /Im0 Do Q".encode())
+            page[NameObject("/Resources")] = DictionaryObject(resources)
+            page[NameObject("/Contents")] = stream
+            writer.add_page(page)
+        writer.close()
+    return os.path.getsize(path)
+
+def generate_corpus(
+        folder: str,
+        page_counts: Sequence[int],
+        content: Content="mixed",
+        seed: int=0,
+        image_size: tuple[int, int]=(300, 424)
+    ) -> List[str]:
+    """
+    Write one synthetic document per page count into `folder`, reusing the ones already there.
+
+    Returns:
+        List[str]: The paths of the documents, in the order of `page_counts`.
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index, pages in enumerate(page_counts):
+        path = os.path.join(folder, f'synthetic_{content}_{pages}p_{seed + index}.pdf')
+        if not os.path.exists(path):
+            generate_pdf(f'{path}.tmp', pages, content, seed=seed + index, image_size=image_size)
+            os.replace(f'{path}.tmp', path)
+        paths.append(path)
+    return paths
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Generate synthetic scanned-like PDFs for the benchmarks.')
+    parser.add_argument('folder')
+    parser.add_argument('pages', type=int, nargs='+', help='page count of each document')
+    parser.add_argument('--content', default='mixed', choices=["text", "image", "mixed"])
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+    for path in generate_corpus(arguments.folder, arguments.pages, arguments.content, arguments.seed):
+        print(path)
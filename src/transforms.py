@@ -0,0 +1,174 @@
+import pypdf
+from typing import Callable, Literal
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    PdfObject,
+    RectangleObject,
+    StreamObject
+)
+
+Engine = Literal["scale", "xobject"]
+FitMode = Literal["stretch", "fit"]
+Format = Literal["A2", "A3", "A4", "A5", "L13"]
+
+# Paper formats, width and height in millimeters
+FORMATS: dict[str, tuple[int, int]] = {
+    "A2": (420, 594),
+    "A3": (297, 420),
+    "A4": (210, 297),
+    "A5": (148, 210),
+    "L13": (216, 330)
+}
+
+POINTS_PER_MM = 2.83464567
+
+def format_dimensions(desired_format: Format) -> tuple[float, float]:
+    """Width and height of a paper format in points."""
+    if desired_format not in FORMATS:
+        raise ValueError(f'Unknown format "{desired_format}", expected one of {", ".join(FORMATS)}.')
+    width, height = FORMATS[desired_format]
+    return round(width * POINTS_PER_MM, 3), round(height * POINTS_PER_MM, 3)
+
+def placement_matrix(
+        box: RectangleObject,
+        dimensions: tuple[float, float],
+        fit: FitMode="stretch"
+    ) -> tuple[float, float, float, float, float, float]:
+    """
+    Compute the matrix that maps `box` onto a page of `dimensions`.
+
+    Args:
+        box (RectangleObject): The original page box.
+        dimensions (tuple[float, float]): The target width and height in points.
+        fit (FitMode): "stretch" scales each axis independently to fill the page,
+            "fit" keeps the aspect ratio and centers the content, like pdf-lib's
+            scaleToFit in converter.js.
+
+    Returns:
+        tuple: The (a, b, c, d, e, f) operands of the `cm` operator.
+    """
+    left, bottom = float(box.left), float(box.bottom)
+    width, height = float(box.width), float(box.height)
+    width_scale_factor = dimensions[0] / width
+    height_scale_factor = dimensions[1] / height
+    if fit == "fit":
+        width_scale_factor = height_scale_factor = min(width_scale_factor, height_scale_factor)
+    offset_x = (dimensions[0] - width * width_scale_factor) / 2 - left * width_scale_factor
+    offset_y = (dimensions[1] - height * height_scale_factor) / 2 - bottom * height_scale_factor
+    return width_scale_factor, 0.0, 0.0, height_scale_factor, offset_x, offset_y
+
+def scale_page(page: pypdf.PageObject, dimensions: tuple[float, float]) -> pypdf.PageObject:
+    """
+    Resize a page in place with pypdf's `scale()`, which rewrites its content stream.
+    """
+    width_scale_factor = dimensions[0] / float(page.mediabox.width)
+    height_scale_factor = dimensions[1] / float(page.mediabox.height)
+    page.scale(width_scale_factor, height_scale_factor)
+    page.mediabox.lower_left = (0, 0)
+    page.mediabox.upper_right = dimensions
+    return page
+
+def page_as_form(page: pypdf.PageObject) -> StreamObject:
+    """
+    Build a form XObject holding the page content and resources.
+
+    A single content stream keeps its encoded bytes and filters, so nothing is
+    decoded or parsed. Content split over several streams is decoded and joined.
+    """
+    contents = page.get("/Contents")
+    contents = contents.get_object() if contents is not None else None
+    if isinstance(contents, EncodedStreamObject):
+        form = EncodedStreamObject()
+        form._data = contents._data
+        for key in ("/Filter", "/DecodeParms"):
+            if key in contents:
+                form[NameObject(key)] = contents.raw_get(key)
+    else:
+        form = DecodedStreamObject()
+        if isinstance(contents, ArrayObject):
+            form.set_data(b"\n".join(stream.get_object().get_data() for stream in contents))
+        elif contents is not None:
+            form.set_data(contents.get_data())
+    form[NameObject("/Type")] = NameObject("/XObject")
+    form[NameObject("/Subtype")] = NameObject("/Form")
+    form[NameObject("/BBox")] = RectangleObject(page.mediabox)
+    if "/Resources" in page:
+        form[NameObject("/Resources")] = page.raw_get("/Resources")
+    if "/Group" in page:
+        form[NameObject("/Group")] = page.raw_get("/Group")
+    return form
+
+def wrap_page(
+        page: pypdf.PageObject,
+        dimensions: tuple[float, float],
+        fit: FitMode="stretch",
+        register: Callable[[PdfObject], IndirectObject]=lambda obj: obj
+    ) -> pypdf.PageObject:
+    """
+    Build a new page of `dimensions` that draws `page` as a form XObject.
+
+    The original content stream is never rewritten: the new page only holds
+    `q <matrix> cm /Fx0 Do Q`, so the cost per page stays constant whatever
+    the page complexity. Annotation rectangles are mapped with the same matrix.
+
+    Args:
+        register (Callable): Turns a new object into an indirect reference of
+            the document the page is going to, see `writer_register`.
+
+    Returns:
+        pypdf.PageObject: The new page, not yet added to any document.
+    """
+    matrix = placement_matrix(page.mediabox, dimensions, fit)
+    content = DecodedStreamObject()
+    content.set_data(
+        b"q %s cm /Fx0 Do Q" % b" ".join(f"{value:.6f}".encode() for value in matrix)
+    )
+
+    new_page = pypdf.PageObject.create_blank_page(None, dimensions[0], dimensions[1])
+    del new_page[NameObject("/Parent")]
+    new_page[NameObject("/Resources")] = DictionaryObject({
+        NameObject("/XObject"): DictionaryObject({NameObject("/Fx0"): register(page_as_form(page))})
+    })
+    new_page[NameObject("/Contents")] = register(content)
+    if "/Rotate" in page:
+        new_page[NameObject("/Rotate")] = page.raw_get("/Rotate")
+
+    # /Annots, its entries and their /Rect are often indirect
+    annotations = page.get("/Annots")
+    annotations = annotations.get_object() if annotations is not None else None
+    if isinstance(annotations, ArrayObject):
+        moved_annotations = ArrayObject()
+        for annotation in annotations:
+            annotation = annotation.get_object()
+            if not isinstance(annotation, DictionaryObject):
+                continue
+            annotation_obj = DictionaryObject({
+                key: value for key, value in annotation.items() if key != "/P"
+            })
+            rectangle = annotation_obj.get("/Rect")
+            rectangle = rectangle.get_object() if rectangle is not None else None
+            if isinstance(rectangle, ArrayObject):
+                x1, y1, x2, y2 = (float(value.get_object()) for value in rectangle[:4])
+                annotation_obj[NameObject("/Rect")] = ArrayObject([
+                    FloatObject(x1 * matrix[0] + matrix[4]),
+                    FloatObject(y1 * matrix[3] + matrix[5]),
+                    FloatObject(x2 * matrix[0] + matrix[4]),
+                    FloatObject(y2 * matrix[3] + matrix[5])
+                ])
+            moved_annotations.append(register(annotation_obj))
+        new_page[NameObject("/Annots")] = moved_annotations
+    return new_page
+
+def writer_register(writer: pypdf.PdfWriter) -> Callable[[PdfObject], IndirectObject]:
+    """
+    Return a `register` callback for `wrap_page` that adds objects to a PdfWriter.
+    """
+    # pypdf 4 has no public way to register a new indirect object yet.
+    # Back references are left out so a link annotation does not drag the whole page tree along.
+    return lambda obj: writer._add_object(obj.clone(writer, ignore_fields=("/P", "/Parent")))
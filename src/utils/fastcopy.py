@@ -0,0 +1,167 @@
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Iterable, Iterator, Literal
+from utils.source import open_source, share_latency
+
+LinkMode = Literal["copy", "reflink", "hardlink"]
+
+FICLONE = 0x40049409
+
+PARTIAL_SUFFIX = '.partial'
+
+# Bytes read at once by the regular copies, one round trip each on a share
+COPY_CHUNK = 1024 * 1024
+
+def _reflink(source: str, destination: str) -> bool:
+    """
+        Try to clone `source` into `destination` sharing the same disk blocks (copy on write)
+    """
+    if sys.platform.startswith('linux'):
+        import fcntl
+        with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+            try:
+                fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+                return True
+            except OSError:
+                pass
+        os.remove(destination)
+        return False
+    if sys.platform == 'darwin':
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.clonefile(os.fsencode(source), os.fsencode(destination), 0) == 0
+    return False
+
+def temporary_path(path: str) -> str:
+    """
+        Hidden name next to `path` where its content is written before being renamed into place
+    """
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f'.{name}.{os.getpid()}{PARTIAL_SUFFIX}')
+
+def _fsync(path: str) -> None:
+    with open(path, 'rb') as file:
+        os.fsync(file.fileno())
+
+def _fsync_directory(path: str) -> None:
+    """
+        Persist a rename: on POSIX the directory entry is only durable once its folder is synced
+    """
+    try:
+        folder = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    except OSError:
+        # Windows cannot open a folder, its renames are journaled by NTFS
+        return
+    try:
+        os.fsync(folder)
+    except OSError:
+        pass
+    finally:
+        os.close(folder)
+
+def _replace(temporary: str, destination: str) -> None:
+    os.replace(temporary, destination)
+    _fsync_directory(destination)
+
+@contextmanager
+def atomic_output(path: str) -> Iterator[BinaryIO]:
+    """
+        Open a temporary file that replaces `path` once written and synced to disk.
+
+        A crash or an error while writing leaves the previous `path` (or none) in place,
+        never a truncated one. Replacing the entry also leaves a hardlinked source untouched.
+        A file written to a throttled folder waits once (see utils.source.throttle_share).
+    """
+    temporary = temporary_path(path)
+    time.sleep(share_latency(path))
+    try:
+        with open(temporary, 'wb') as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        _replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+def clone_file(source: str, destination: str, mode: LinkMode = "reflink") -> LinkMode:
+    """
+        Copy `source` to `destination` byte for byte, using the cheapest method available.
+
+        "hardlink" links the output to the source (only safe when sources are never edited in place),
+        "reflink" shares the disk blocks on filesystems that support it (Btrfs, XFS, APFS),
+        both fall back to a regular copy. Like `atomic_output`, the copy is made under a
+        temporary name and renamed into place. From or to a throttled folder (see
+        utils.source.throttle_share) the copy is a regular one that pays its latency.
+
+        Returns the method that was actually used.
+    """
+    temporary = temporary_path(destination)
+    try:
+        if share_latency(source) or share_latency(destination):
+            copy_file(source, temporary)
+            used = "copy"
+        else:
+            used = _clone(source, temporary, mode)
+        if used != "hardlink":
+            _fsync(temporary)
+        _replace(temporary, destination)
+    except BaseException:
+        if os.path.lexists(temporary):
+            os.remove(temporary)
+        raise
+    return used
+
+def copy_batch(pairs: Iterable[tuple[str, str]]) -> None:
+    """
+        Copy each (source, destination) pair atomically, like `clone_file` in "copy" mode,
+        but syncing every destination folder once for the whole batch.
+
+        The files are all written and synced under temporary names before the first
+        rename, so a failure while copying leaves every destination as it was.
+    """
+    renames = []
+    try:
+        for source, destination in pairs:
+            temporary = temporary_path(destination)
+            renames.append((temporary, destination))
+            copy_file(source, temporary)
+            _fsync(temporary)
+        for temporary, destination in renames:
+            os.replace(temporary, destination)
+    except BaseException:
+        for temporary, _ in renames:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        raise
+    for folder in {os.path.dirname(destination) for _, destination in renames}:
+        _fsync_directory(os.path.join(folder, ''))
+
+def _clone(source: str, destination: str, mode: LinkMode) -> LinkMode:
+    if mode == "hardlink":
+        try:
+            os.link(source, destination)
+            return "hardlink"
+        except OSError:
+            pass
+    if mode in ("reflink", "hardlink") and _reflink(source, destination):
+        return "reflink"
+    shutil.copyfile(source, destination)
+    return "copy"
+
+def copy_file(source: str, destination: str) -> None:
+    """
+        Regular copy of `source` to `destination`. From a throttled folder (see
+        utils.source.throttle_share) it reads through `open_source` chunk by chunk, each
+        chunk paying the latency, and a destination in a throttled folder waits once.
+    """
+    time.sleep(share_latency(destination))
+    if not share_latency(source):
+        shutil.copyfile(source, destination)
+        return
+    with open_source(source) as source_file, open(destination, 'wb') as destination_file:
+        shutil.copyfileobj(source_file, destination_file, COPY_CHUNK)
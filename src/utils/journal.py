@@ -0,0 +1,124 @@
+import json
+import os
+from typing import List, Optional
+
+class BatchJournal:
+    """
+    Append-only record of the jobs finished by the current batch.
+
+    Every converted document adds one JSON line, synced to disk before the
+    next one, so after a crash the journal lists exactly the outputs that
+    were completely written (outputs are renamed into place once written,
+    see utils.fastcopy.atomic_output). The first line names the command of
+    the batch, for `resume`. A line cut by the crash is ignored.
+
+    The SkipManifest holds the same information but is only saved every 100
+    documents; once a batch ends and the manifest is saved the journal is
+    cleared. Only the run that began the journal writes to it and clears it:
+    the commands that do not journal leave an interrupted batch for `resume`.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.__path = path
+        self.__file = None
+        self.__owned = False
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def __append(self, entry: dict) -> None:
+        if self.__file is None:
+            self.__file = open(self.__path, 'a', encoding='utf-8')
+        self.__file.write(json.dumps(entry) + '\n')
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    @property
+    def owned(self) -> bool:
+        """Whether this run began the journal, or carries on with its interrupted batch."""
+        return self.__owned
+
+    def begin(self, command: str) -> None:
+        """
+        Start a batch of `command`, or carry on with the interrupted batch of the
+        same command. The interrupted batch of another command is left alone.
+        """
+        journaled, _ = self.read()
+        if journaled is None:
+            # Nothing to resume, entries left without a command line are dropped
+            self.clear()
+            self.__append({"command": command})
+        self.__owned = journaled in (None, command)
+
+    def record(
+            self,
+            source_path: str,
+            output_path: str,
+            desired_format: str,
+            sha256: Optional[str]=None,
+            size: Optional[int]=None,
+            mtime_ns: Optional[int]=None
+        ) -> None:
+        """Journal a written output, with the size and mtime its source had when converted when known."""
+        if not self.__owned:
+            return
+        if size is None or mtime_ns is None:
+            try:
+                stat = os.stat(source_path)
+            except FileNotFoundError:
+                # Moved or deleted since, `resume` could not take it back anyway
+                return
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        self.__append({
+            "source": source_path,
+            "output": output_path,
+            "format": desired_format,
+            "sha256": sha256,
+            "size": size,
+            "mtime_ns": mtime_ns
+        })
+
+    def forget(self, source_path: str) -> None:
+        """Withdraw the earlier entries of a source, when another of its outputs failed."""
+        if self.__owned:
+            self.__append({"forget": source_path})
+
+    def read(self) -> tuple[Optional[str], List[dict]]:
+        """
+        Returns:
+            tuple: The command of the journaled batch (None without a journal) and
+                its finished jobs, in completion order.
+        """
+        command, entries = None, []
+        if not os.path.isfile(self.__path):
+            return command, entries
+        with open(self.__path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if "command" in entry:
+                    command = command or entry["command"]
+                elif "forget" in entry:
+                    entries = [kept for kept in entries if kept["source"] != entry["forget"]]
+                else:
+                    entries.append(entry)
+        return command, entries
+
+    def finish(self) -> None:
+        """End the run: the journal is cleared when this run began it, kept otherwise."""
+        if self.__owned:
+            self.clear()
+
+    def clear(self) -> None:
+        self.__owned = False
+        self.close()
+        if os.path.exists(self.__path):
+            os.remove(self.__path)
+
+    def close(self) -> None:
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
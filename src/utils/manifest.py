@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+from typing import Optional
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+        Return the sha256 hex digest of a file, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class SkipManifest:
+    """
+    Persistent record of the inputs already converted into an output tree.
+
+    Every entry holds the content hash, size and mtime of a source plus the
+    format it was converted to. A source is current when its size and mtime
+    still match (no read at all) or, if only the mtime moved, when its hash
+    still matches. Current sources are skipped without opening pypdf.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.__path = path
+        self.__entries: dict[str, dict] = {}
+        self.__dirty = False
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                self.__entries = json.load(file)
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def is_current(self, source_path: str, output_path: str, desired_format: str) -> bool:
+        entry = self.__entries.get(source_path)
+        if entry is None or entry["format"] != desired_format or not os.path.exists(output_path):
+            return False
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return False
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        if hash_file(source_path) != entry["sha256"]:
+            return False
+        entry["mtime_ns"] = stat.st_mtime_ns
+        self.__dirty = True
+        return True
+
+    def record(
+            self,
+            source_path: str,
+            desired_format: str,
+            sha256: Optional[str] = None,
+            size: Optional[int] = None,
+            mtime_ns: Optional[int] = None
+        ) -> None:
+        """
+            Record a converted source, with the size and mtime it had when converted when known.
+            A source moved or deleted since is left out: it is not current anymore anyway.
+        """
+        try:
+            if size is None or mtime_ns is None:
+                stat = os.stat(source_path)
+                size, mtime_ns = stat.st_size, stat.st_mtime_ns
+            sha256 = sha256 or hash_file(source_path)
+        except FileNotFoundError:
+            return
+        self.__entries[source_path] = {
+            "sha256": sha256,
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "format": desired_format
+        }
+        self.__dirty = True
+
+    def restore(self, entry: dict) -> None:
+        """
+            Take back a document journaled by an interrupted batch (see utils.journal.BatchJournal)
+        """
+        if entry.get("sha256") is None:
+            return
+        self.__entries[entry["source"]] = {
+            "sha256": entry["sha256"],
+            "size": entry["size"],
+            "mtime_ns": entry["mtime_ns"],
+            "format": entry["format"]
+        }
+        self.__dirty = True
+
+    def forget(self, source_path: str) -> None:
+        if self.__entries.pop(source_path, None) is not None:
+            self.__dirty = True
+
+    def save(self) -> None:
+        if not self.__dirty:
+            return
+        temporary_path = f'{self.__path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(self.__entries, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.__path)
+        self.__dirty = False
@@ -0,0 +1,36 @@
+import os
+from typing import Optional
+
+try:
+    import psutil
+except ImportError:
+    # Without psutil the resident size is read from /proc, Linux only
+    psutil = None
+
+MB = 1024 * 1024
+
+def rss_bytes(pid: Optional[int]=None) -> Optional[int]:
+    """
+    Resident set size of a process, the current one by default.
+
+    Returns:
+        int, optional: The size in bytes, None when it cannot be measured
+            (the process is gone, or neither psutil nor /proc is available).
+    """
+    pid = pid or os.getpid()
+    try:
+        if psutil is not None:
+            return psutil.Process(pid).memory_info().rss
+        with open(f'/proc/{pid}/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return None
+
+def physical_memory() -> Optional[int]:
+    """Total physical memory in bytes, None when it cannot be measured."""
+    try:
+        if psutil is not None:
+            return psutil.virtual_memory().total
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
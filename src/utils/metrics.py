@@ -0,0 +1,112 @@
+import json
+import math
+import os
+from typing import Iterable, Iterator, List, Optional, TextIO
+
+# Stages of ResizeResult.timings: open/parse, scale, serialize/write, plus the pipeline and split extras
+STAGES = ["fetch", "read", "transform", "write", "stitch", "total"]
+PERCENTILES = [50, 95, 99]
+
+class MetricsSink:
+    """
+    Append the metrics of every resized document to a JSONL file.
+
+    Each document gives one "document" line (status, pages, bytes, stage
+    timings, error) followed, when the job measured them, by one "page" line
+    per page with the seconds spent scaling it. Lines are flushed as they are
+    written, so an interrupted run keeps the metrics of what it finished.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.__path = path
+        self.__file: Optional[TextIO] = None
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def record(self, result) -> None:
+        """
+        Args:
+            result (ResizeResult): The result of a whole document.
+        """
+        if self.__file is None:
+            os.makedirs(os.path.dirname(self.__path) or '.', exist_ok=True)
+            self.__file = open(self.__path, 'a')
+        lines = [{
+            "type": "document",
+            "source": result.source_path,
+            "output": result.output_path,
+            "status": result.status,
+            "pages": result.pages,
+            "bytes_in": result.bytes_in,
+            "bytes_out": result.bytes_out,
+            "passthrough": result.passthrough,
+            "timings": result.timings,
+            "error": result.error
+        }]
+        lines += [
+            {"type": "page", "source": result.source_path, "page": page, "transform": seconds}
+            for page, seconds in enumerate(result.page_timings)
+        ]
+        self.__file.writelines(json.dumps(line) + '\n' for line in lines)
+        self.__file.flush()
+
+    def close(self) -> None:
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+def read_metrics(path: str) -> Iterator[dict]:
+    with open(path, 'r') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+def percentile(values: List[float], rank: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    return values[max(0, math.ceil(rank / 100 * len(values)) - 1)]
+
+def summarize(records: Iterable[dict]) -> dict:
+    """
+    Aggregate metrics lines into percentiles per stage.
+
+    Returns:
+        dict: Document and page counts, bytes, failures and, for each stage
+            found ("page" being the per-page scale time), its count, total and
+            p50/p95/p99 in seconds.
+    """
+    samples: dict[str, List[float]] = {}
+    summary = {"documents": 0, "failed": 0, "pages": 0, "bytes_in": 0, "bytes_out": 0, "stages": {}}
+    for record in records:
+        if record["type"] == "page":
+            samples.setdefault("page", []).append(record["transform"])
+            continue
+        summary["documents"] += 1
+        summary["failed"] += record["status"] == "failed"
+        summary["pages"] += record["pages"]
+        summary["bytes_in"] += record["bytes_in"]
+        summary["bytes_out"] += record["bytes_out"]
+        for stage, seconds in record["timings"].items():
+            samples.setdefault(stage, []).append(seconds)
+    for stage in sorted(samples, key=lambda stage: STAGES.index(stage) if stage in STAGES else len(STAGES)):
+        values = sorted(samples[stage])
+        summary["stages"][stage] = {
+            "count": len(values),
+            "total": sum(values),
+            **{f"p{rank}": percentile(values, rank) for rank in PERCENTILES}
+        }
+    return summary
+
+def format_summary(summary: dict) -> str:
+    lines = [
+        f'{summary["documents"]} documents ({summary["failed"]} failed), {summary["pages"]} pages, '
+        f'{summary["bytes_in"] / 1024 / 1024:.1f} MB in, {summary["bytes_out"] / 1024 / 1024:.1f} MB out',
+        "{:<10} {:>8} {:>12} {:>10} {:>10} {:>10}".format("Stage", "Count", "Total (s)", "p50 (ms)", "p95 (ms)", "p99 (ms)"),
+        "-" * 65
+    ]
+    for stage, stats in summary["stages"].items():
+        lines.append("{:<10} {:>8} {:>12.3f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            stage, stats["count"], stats["total"], stats["p50"] * 1000, stats["p95"] * 1000, stats["p99"] * 1000
+        ))
+    return "\n".join(lines)
@@ -0,0 +1,143 @@
+import cProfile
+import os
+import pstats
+import tracemalloc
+from typing import Any, Callable, Iterable, List, Optional
+
+# Folder of our own modules, to tell our code apart from pypdf and the standard library
+SOURCE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Largest snapshot taken by `checkpoint` during the current profiled call
+_peak_snapshot: Optional[tuple[int, tracemalloc.Snapshot]] = None
+
+class _RawStats:
+    """Adapter letting pstats load the plain stats dict shipped back from a worker."""
+
+    def __init__(self, stats: dict) -> None:
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+def checkpoint() -> None:
+    """
+    Mark a point where the engine holds the most memory (the whole document
+    parsed and resized, or a full window). While a call is profiled, the
+    snapshot taken at the checkpoint with the most traced memory is the one
+    reported; otherwise this only costs a function call.
+    """
+    global _peak_snapshot
+    if not tracemalloc.is_tracing():
+        return
+    current = tracemalloc.get_traced_memory()[0]
+    if _peak_snapshot is None or current > _peak_snapshot[0]:
+        _peak_snapshot = (current, tracemalloc.take_snapshot())
+
+def profile_call(function: Callable, *args, allocation_sites: int=50) -> tuple[Any, dict]:
+    """
+    Call `function` under cProfile and tracemalloc.
+
+    Returns:
+        tuple: The return value of the call and its profile: the raw pstats
+            dict (picklable, unlike pstats.Stats), the peak of traced memory and
+            the `allocation_sites` source lines holding the most memory at the
+            largest checkpoint (or at the end of the call), as [site, bytes, blocks].
+    """
+    global _peak_snapshot
+    _peak_snapshot = None
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        value = function(*args)
+    finally:
+        profiler.disable()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        snapshot = _peak_snapshot[1] if _peak_snapshot else tracemalloc.take_snapshot()
+        _peak_snapshot = None
+        if not already_tracing:
+            tracemalloc.stop()
+    profiler.create_stats()
+    allocations = [
+        [f'{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}', statistic.size, statistic.count]
+        for statistic in snapshot.statistics('lineno')[:allocation_sites]
+    ]
+    return value, {"stats": profiler.stats, "allocations": allocations, "peak_bytes": peak_bytes, "documents": 1}
+
+def combine(profiles: Iterable[dict]) -> Optional[dict]:
+    """Merge the profiles of several calls (the parts of a split document) into one."""
+    report = ProfileReport()
+    for profile in profiles:
+        report.add(profile)
+    if not report.documents:
+        return None
+    return {**report.as_profile(), "documents": 1}
+
+def component(filename: str) -> str:
+    # Built-in functions are reported under the file name "~"
+    if filename == '~':
+        return 'python'
+    if 'pypdf' in filename:
+        return 'pypdf'
+    if os.path.abspath(filename).startswith(SOURCE_ROOT):
+        return 'resize'
+    return 'python'
+
+class ProfileReport:
+    """Profiles of the sampled documents, merged in the parent."""
+
+    def __init__(self) -> None:
+        self.__stats: Optional[pstats.Stats] = None
+        self.__allocations: dict[str, List[int]] = {}
+        self.__peak_bytes = 0
+        self.documents = 0
+
+    def add(self, profile: dict) -> None:
+        if self.__stats is None:
+            self.__stats = pstats.Stats(_RawStats(profile["stats"]))
+        else:
+            self.__stats.add(_RawStats(profile["stats"]))
+        for site, size, count in profile["allocations"]:
+            totals = self.__allocations.setdefault(site, [0, 0])
+            totals[0] += size
+            totals[1] += count
+        self.__peak_bytes = max(self.__peak_bytes, profile["peak_bytes"])
+        self.documents += profile["documents"]
+
+    def as_profile(self) -> dict:
+        return {
+            "stats": self.__stats.stats,
+            "allocations": [[site, size, count] for site, (size, count) in self.__allocations.items()],
+            "peak_bytes": self.__peak_bytes,
+            "documents": self.documents
+        }
+
+    def dump(self, path: str) -> None:
+        """Save the merged stats in the pstats format, for snakeviz or `python -m pstats`."""
+        self.__stats.dump_stats(path)
+
+    def format(self, top: int=20) -> str:
+        """
+        Describe where the time and the memory went: own time per component
+        (pypdf, our code, the rest of Python), the `top` functions by own time
+        and the `top` allocation sites.
+        """
+        stats = self.__stats.stats
+        components: dict[str, float] = {}
+        for (filename, _, _), (_, _, own_time, _, _) in stats.items():
+            components[component(filename)] = components.get(component(filename), 0.0) + own_time
+        total_time = sum(components.values()) or 1.0
+        lines = [f'Profile of {self.documents} sampled documents', '', 'Own time per component:']
+        for name, seconds in sorted(components.items(), key=lambda item: -item[1]):
+            lines.append(f'  {name:<8} {seconds:10.3f} s {seconds / total_time * 100:6.1f}%')
+        lines += ['', f'Top {top} functions by own time:', "  {:>10} {:>10} {:>10}  {}".format("Calls", "Own (s)", "Cum. (s)", "Function")]
+        hottest = sorted(stats.items(), key=lambda item: -item[1][2])[:top]
+        for (filename, line, function), (_, calls, own_time, cumulative_time, _) in hottest:
+            lines.append(f'  {calls:>10} {own_time:>10.3f} {cumulative_time:>10.3f}  {function} ({os.path.basename(filename)}:{line}, {component(filename)})')
+        lines += ['', f'Top {top} allocation sites at the memory peak of each document (largest peak {self.__peak_bytes / 1024 / 1024:.1f} MB):']
+        for site, (size, count) in sorted(self.__allocations.items(), key=lambda item: -item[1][0])[:top]:
+            lines.append(f'  {size / 1024:>10.1f} KiB {count:>8} blocks  {site}')
+        return '\n'.join(lines)
@@ -2,11 +2,11 @@ Number = float | int
 
 def create_report(
         content: Number | str,
-        writting_path: str,
+        writting_path: str='report.txt',
 ):
     """
         Create a report with all the data collected during the resising process as a '.txt' file
     """
-    with open('report.txt',  'w') as report_file:
+    with open(writting_path,  'w') as report_file:
 
-        report_file.write(content)
\ No newline at end of file
+        report_file.write(str(content))
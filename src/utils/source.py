@@ -0,0 +1,114 @@
+import hashlib
+import io
+import mmap
+import os
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Literal, Union
+
+InputMode = Literal["buffered", "mmap", "memory"]
+
+# Folders standing in for a slow network share, see `throttle_share`. Kept in the
+# environment so that worker processes inherit it, however they are started
+SHARE_LATENCY_VARIABLE = 'RESIZE_PDF_SHARE_LATENCY'
+
+def throttle_share(latency: float, *folders: str) -> None:
+    """
+        Make the files under `folders` as slow as on a network share, for this process
+        and the ones it starts: every read waits `latency` seconds first (see
+        ThrottledFile) and so does every file written. A local folder can then stand
+        in for a share when comparing staged and direct runs.
+    """
+    if latency:
+        os.environ[SHARE_LATENCY_VARIABLE] = os.pathsep.join([str(latency), *(os.path.abspath(folder) for folder in folders)])
+    else:
+        os.environ.pop(SHARE_LATENCY_VARIABLE, None)
+
+def share_latency(path: str) -> float:
+    """
+        Seconds each access to `path` waits, 0 outside the folders of `throttle_share`
+    """
+    setting = os.environ.get(SHARE_LATENCY_VARIABLE)
+    if not setting:
+        return 0.0
+    latency, *folders = setting.split(os.pathsep)
+    path = os.path.abspath(path)
+    return float(latency) if any(os.path.commonpath([path, folder]) == folder for folder in folders) else 0.0
+
+class ThrottledFile(io.RawIOBase):
+    """
+        Raw file whose every read first waits `latency` seconds, like a round trip to a
+        share. Behind a BufferedReader only the reads that miss the buffer pay it, as
+        only those would be requests of the share client.
+    """
+
+    def __init__(self, file: io.FileIO, latency: float) -> None:
+        self.__file = file
+        self.__latency = latency
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        time.sleep(self.__latency)
+        return self.__file.readinto(buffer)
+
+    def readall(self) -> bytes:
+        time.sleep(self.__latency)
+        return self.__file.readall()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.__file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.__file.tell()
+
+    def fileno(self) -> int:
+        return self.__file.fileno()
+
+@contextmanager
+def open_source(path: str, mode: InputMode = "buffered") -> Iterator[Union[BinaryIO, mmap.mmap]]:
+    """
+        Open a source PDF for pypdf.
+
+        "buffered" is a regular file object: every seek and read pypdf does is a syscall
+        plus a copy through Python's read buffer.
+        "mmap" maps the file read-only, so pypdf's reads are served straight from the
+        page cache without syscalls, and hashing reads the mapping without any copy.
+        "memory" reads the whole file with a single call into a BytesIO, which shares
+        the bytes object instead of copying it; one large read suits high-latency shares.
+
+        Under a throttled folder (see `throttle_share`) reads go through a buffered
+        ThrottledFile, "mmap" included since the reads of a mapping cannot be delayed.
+    """
+    latency = share_latency(path)
+    with open(path, 'rb', buffering=0 if latency else -1) as file:
+        if latency:
+            file = io.BufferedReader(ThrottledFile(file, latency))
+        if mode == "memory":
+            yield io.BytesIO(file.read())
+            return
+        if mode != "mmap" or latency or os.fstat(file.fileno()).st_size == 0:
+            yield file
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+def source_digest(source: Union[BinaryIO, mmap.mmap], chunk_size: int = 1024 * 1024) -> str:
+    """
+        Return the sha256 hex digest of an opened source, leaving it at position 0
+    """
+    if isinstance(source, mmap.mmap):
+        return hashlib.sha256(source).hexdigest()
+    if isinstance(source, io.BytesIO):
+        # getvalue() hands back the shared bytes object, getbuffer() would copy them
+        return hashlib.sha256(source.getvalue()).hexdigest()
+    digest = hashlib.sha256()
+    source.seek(0)
+    for chunk in iter(lambda: source.read(chunk_size), b''):
+        digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()
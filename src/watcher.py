@@ -0,0 +1,97 @@
+import os
+import time
+from typing import List, Optional
+from discovery import RetrievedFilesType
+
+class FolderWatcher:
+    """
+    Detect new or rewritten files in a folder tree without rescanning it.
+
+    A folder is listed again only when its own mtime changes, which happens
+    whenever an entry is created, renamed or removed in it. Files found that
+    way are kept as candidates and re-checked one by one (a single stat) until
+    their size and mtime have not moved for `stable_seconds`, so a scan the
+    scanner is still writing is never picked up half-written. Overwriting a
+    file in place leaves its folder's mtime alone, so the files already
+    dispatched are re-checked with a single stat each as well.
+    """
+
+    def __init__(
+            self,
+            root: str,
+            extension: str='pdf',
+            recursive: bool=False,
+            stable_seconds: float=3.0
+        ) -> None:
+        self.__suffix = f'.{extension.lower()}'
+        self.__recursive = recursive
+        self.__stable_seconds = stable_seconds
+        self.__directories: dict[str, Optional[int]] = {root: None}
+        self.__candidates: dict[str, tuple[int, int, float]] = {}
+        self.__dispatched: dict[str, tuple[int, int]] = {}
+
+    @property
+    def pending(self) -> int:
+        """Number of files seen but not stable yet."""
+        return len(self.__candidates)
+
+    def __list_directory(self, folder: str, now: float) -> None:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if self.__recursive:
+                        self.__directories.setdefault(entry.path, None)
+                elif entry.name.lower().endswith(self.__suffix) and entry.is_file():
+                    stat = entry.stat()
+                    fingerprint = (stat.st_size, stat.st_mtime_ns)
+                    if self.__dispatched.get(entry.path) != fingerprint and entry.path not in self.__candidates:
+                        self.__candidates[entry.path] = (*fingerprint, now)
+
+    def poll(self) -> List[RetrievedFilesType]:
+        """
+        Look for changes since the previous call.
+
+        Returns:
+            List[RetrievedFilesType]: The files that became stable, each one reported once
+                (again only if it is later rewritten).
+        """
+        now = time.monotonic()
+        for folder, listed_mtime in list(self.__directories.items()):
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except FileNotFoundError:
+                del self.__directories[folder]
+                continue
+            if mtime != listed_mtime:
+                self.__directories[folder] = mtime
+                self.__list_directory(folder, now)
+
+        for path, fingerprint in list(self.__dispatched.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.__dispatched[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != fingerprint and path not in self.__candidates:
+                self.__candidates[path] = (stat.st_size, stat.st_mtime_ns, now)
+
+        ready = []
+        for path, (size, mtime, since) in list(self.__candidates.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.__candidates[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                self.__candidates[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif size > 0 and now - since >= self.__stable_seconds:
+                del self.__candidates[path]
+                self.__dispatched[path] = (size, mtime)
+                ready.append(RetrievedFilesType(
+                    name=os.path.basename(path),
+                    path=path,
+                    created_at=stat.st_ctime,
+                    last_modified_at=stat.st_mtime,
+                    size=size
+                ))
+        return ready
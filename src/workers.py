@@ -0,0 +1,209 @@
+import multiprocessing
+import queue
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional
+from utils.memory import MB, physical_memory, rss_bytes
+
+# Sentinel asking a worker to exit instead of running another task
+STOP = None
+
+@dataclass(frozen=True)
+class MemoryLimits:
+    """Memory governance of a WorkerPool, 0 turning a limit off."""
+    # Tasks a worker runs before it is replaced by a fresh process
+    jobs_per_worker: int = 100
+    # Resident size above which a worker is replaced once its task is done
+    worker_mb: int = 1024
+    # Resident size of the pool (workers and parent) above which no task is started, 0 for 75% of the physical memory
+    watermark_mb: int = 0
+    # Sources above either threshold go to the large lane
+    large_mb: int = 100
+    large_pages: int = 1000
+    # Tasks of the large lane running at once, 0 for a quarter of the workers
+    large_workers: int = 0
+
+    def watermark_bytes(self) -> Optional[int]:
+        if self.watermark_mb:
+            return self.watermark_mb * MB
+        total = physical_memory()
+        return int(total * 0.75) if total else None
+
+class WorkerLost(Exception):
+    """A worker exited in the middle of a task, killed by the OOM killer or crashed."""
+
+    def __init__(self, task: tuple, exitcode: Optional[int]) -> None:
+        super().__init__(f'the worker exited with code {exitcode} during the task (out of memory?)')
+        self.task = task
+        self.exitcode = exitcode
+
+def worker_loop(function: Callable, inbox: multiprocessing.Queue, outbox: multiprocessing.Queue, worker_id: int) -> None:
+    while (task := inbox.get()) is not STOP:
+        try:
+            value = function(*task)
+        except Exception as error:
+            value = error
+        outbox.put((worker_id, value))
+
+class _Worker:
+    def __init__(self, worker_id: int, function: Callable, outbox: multiprocessing.Queue) -> None:
+        self.inbox = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=worker_loop, args=(function, self.inbox, outbox, worker_id), daemon=True)
+        self.process.start()
+        self.task: Optional[tuple] = None
+        self.large = False
+        self.tasks_done = 0
+
+class WorkerPool:
+    """
+    Process pool for long batches where a few sources can take far more memory than the rest.
+
+    Unlike multiprocessing.Pool, each worker holds one task at a time, so the
+    pool knows what every process is doing and can govern memory:
+
+    - a worker is replaced by a fresh process after `jobs_per_worker` tasks,
+      or once its task is done when its resident size passed `worker_mb`, which
+      gives back what pypdf leaked or cached;
+    - no task is started while the pool as a whole is above the watermark,
+      unless every worker is idle;
+    - large tasks run in a lane of `large_workers` at most, the other workers
+      keep going through the small ones meanwhile;
+    - a worker killed during a task (by the OOM killer) is replaced and its
+      task handed back as a WorkerLost, instead of hanging the batch.
+
+    Without psutil or /proc the resident sizes are unknown and only the task
+    count limit applies.
+    """
+
+    def __init__(self, function: Callable, workers: int, limits: MemoryLimits=MemoryLimits()) -> None:
+        self.__function = function
+        self.__size = workers
+        self.__limits = limits
+        self.__large_workers = limits.large_workers or max(1, workers // 4)
+        self.__watermark = limits.watermark_bytes()
+        self.__outbox: Optional[multiprocessing.Queue] = None
+        self.__workers: List[_Worker] = []
+        self.__retired: List[multiprocessing.Process] = []
+        self.__backlog: List[tuple[tuple, bool]] = []
+        self.recycled = 0
+        self.lost = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of tasks submitted that have not come back yet."""
+        return len(self.__backlog) + sum(worker.task is not None for worker in self.__workers)
+
+    @property
+    def starved(self) -> bool:
+        """Whether workers are idle only because the backlog holds nothing but large tasks the lane cannot start yet."""
+        large_running = sum(worker.task is not None and worker.large for worker in self.__workers)
+        return (
+            bool(self.__backlog)
+            and large_running >= self.__large_workers
+            and all(large for _, large in self.__backlog)
+            and any(worker.task is None for worker in self.__workers)
+        )
+
+    def start(self) -> None:
+        self.__outbox = multiprocessing.Queue()
+        self.__workers = [_Worker(worker_id, self.__function, self.__outbox) for worker_id in range(self.__size)]
+
+    def close(self) -> None:
+        """Let the workers finish their task and exit."""
+        for worker in self.__workers:
+            worker.inbox.put(STOP)
+        for process in [worker.process for worker in self.__workers] + self.__retired:
+            process.join()
+
+    def terminate(self) -> None:
+        for process in [worker.process for worker in self.__workers] + self.__retired:
+            process.terminate()
+            process.join()
+
+    def submit(self, task: tuple, large: bool=False) -> None:
+        """Queue the arguments of a call, in the large lane when `large`."""
+        self.__backlog.append((task, large))
+        self.__assign()
+
+    def get(self, timeout: Optional[float]=None) -> Any:
+        """
+        Wait for the next task to come back.
+
+        Returns:
+            Any: The return value of the call, the exception it raised or a
+                WorkerLost when its worker died.
+
+        Raises:
+            queue.Empty: Nothing came back before `timeout`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # Wake up every second to notice dead workers and memory given back
+            wait = 1.0 if deadline is None else max(0.0, min(1.0, deadline - time.monotonic()))
+            try:
+                worker_id, value = self.__outbox.get(timeout=wait)
+            except queue.Empty:
+                lost = self.__find_lost()
+                if lost is not None:
+                    return lost
+                self.__assign()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+                continue
+            self.__release(self.__workers[worker_id])
+            self.__assign()
+            return value
+
+    def __replace(self, worker: _Worker) -> None:
+        worker_id = self.__workers.index(worker)
+        self.__workers[worker_id] = _Worker(worker_id, self.__function, self.__outbox)
+
+    def __release(self, worker: _Worker) -> None:
+        worker.task = None
+        worker.tasks_done += 1
+        limits = self.__limits
+        rss = rss_bytes(worker.process.pid) if limits.worker_mb else None
+        if (limits.jobs_per_worker and worker.tasks_done >= limits.jobs_per_worker) or (rss and rss > limits.worker_mb * MB):
+            worker.inbox.put(STOP)
+            self.__retired.append(worker.process)
+            self.__replace(worker)
+            self.recycled += 1
+        # Reap the retired workers that exited
+        self.__retired = [process for process in self.__retired if process.is_alive()]
+
+    def __find_lost(self) -> Optional[WorkerLost]:
+        for worker in self.__workers:
+            if worker.process.is_alive():
+                continue
+            self.__replace(worker)
+            if worker.task is not None:
+                self.lost += 1
+                return WorkerLost(worker.task, worker.process.exitcode)
+        return None
+
+    def __over_watermark(self) -> bool:
+        if self.__watermark is None:
+            return False
+        total = (rss_bytes() or 0) + sum(rss_bytes(worker.process.pid) or 0 for worker in self.__workers)
+        return total > self.__watermark
+
+    def __assign(self) -> None:
+        """Start backlog tasks on the idle workers, as far as the lanes and the watermark allow."""
+        while self.__backlog:
+            idle = [worker for worker in self.__workers if worker.task is None]
+            if not idle:
+                return
+            if len(idle) < len(self.__workers) and self.__over_watermark():
+                return
+            large_running = sum(worker.task is not None and worker.large for worker in self.__workers)
+            index = next(
+                (index for index, (_, large) in enumerate(self.__backlog) if not large or large_running < self.__large_workers),
+                None
+            )
+            if index is None:
+                return
+            task, large = self.__backlog.pop(index)
+            worker = idle[0]
+            worker.task = task
+            worker.large = large
+            worker.inbox.put(task)